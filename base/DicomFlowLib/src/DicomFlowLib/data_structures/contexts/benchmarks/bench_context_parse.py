@@ -0,0 +1,70 @@
+"""
+Benchmark of the per-message cost of a routing-only service (scheduler, flow_tracker): parse a FlowContext
+body and serialize it again without touching the dataframe. Compares full parsing (before: DAG validation
+and DataFrame deserialization) with lazy parsing (after: unvalidated flow, dataframe passed through).
+
+Run from base/DicomFlowLib/src: python -m DicomFlowLib.data_structures.contexts.benchmarks.bench_context_parse
+"""
+import argparse
+import json
+import os
+import time
+
+import yaml
+
+from DicomFlowLib.data_structures.contexts import FlowContext
+from DicomFlowLib.data_structures.flow import Flow
+from .bench_meta_rows import make_datasets
+
+FLOW_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "flow", "tests", "test_flows", "one_job.yaml")
+
+
+def make_context(instances: int) -> FlowContext:
+    with open(FLOW_FILE) as r:
+        flow = Flow(**yaml.safe_load(r))
+    context = FlowContext(flow=flow, src_uid="src")
+    for i, ds in enumerate(make_datasets(instances, extra_tags=0)):
+        context.add_meta_row(f"/CT.{ds.SeriesInstanceUID}.{ds.SOPInstanceUID}.dcm", ds)
+    return context
+
+
+def full_parse(body: bytes):
+    if body.startswith(b"{"):
+        context = FlowContext(**json.loads(body.decode()))
+        context.dataframe
+        return context.model_dump_json().encode()
+    context = FlowContext.from_body(body)
+    context.dataframe
+    return context.to_body()
+
+
+def lazy_parse(body: bytes):
+    return FlowContext.from_body(body, validate_flow=False).to_body()
+
+
+def per_message(function, body: bytes, messages: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(messages):
+        function(body)
+    return (time.perf_counter() - t0) / messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 5000])
+    parser.add_argument("--messages", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'instances':>10} {'format':>8} {'full parse (before)':>20} {'lazy parse (after)':>19} {'speedup':>8}")
+    for size in args.sizes:
+        context = make_context(size)
+        for body_format in ["json", "msgpack"]:
+            body = context.to_body(body_format)
+            t_full = per_message(full_parse, body, args.messages)
+            t_lazy = per_message(lazy_parse, body, args.messages)
+            print(f"{size:>10} {body_format:>8} {t_full * 1000:>18.2f}ms {t_lazy * 1000:>17.2f}ms "
+                  f"{t_full / t_lazy:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of metadata collection in SCPContext: per-instance pd.concat (before) versus accumulating
+rows and building the DataFrame once when it is read (after).
+
+Run from base/DicomFlowLib/src: python -m DicomFlowLib.data_structures.contexts.benchmarks.bench_meta_rows
+"""
+import argparse
+import time
+
+import pandas as pd
+from pydicom.dataset import Dataset
+from pydicom.uid import generate_uid
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+
+
+def make_datasets(instances: int, extra_tags: int = 40):
+    series_uid = generate_uid()
+    datasets = []
+    for i in range(instances):
+        ds = Dataset()
+        ds.SOPInstanceUID = generate_uid()
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "CT"
+        ds.SeriesDescription = "Synthetic CT series"
+        ds.InstanceNumber = i + 1
+        for tag in range(extra_tags):
+            ds.add_new((0x0011, 0x1000 + tag), "LO", f"private value {tag}")
+        datasets.append(ds)
+    return datasets
+
+
+def concat_per_instance(datasets):
+    dataframe = None
+    for i, ds in enumerate(datasets):
+        elems = {"dcm_path": f"/{i}.dcm"}
+        for elem in ds:
+            elems[str(elem.keyword)] = str(elem.value)
+        dataframe = pd.concat([dataframe, pd.DataFrame([elems])], ignore_index=True)
+    return dataframe
+
+
+def accumulate(datasets):
+    context = SCPContext()
+    for i, ds in enumerate(datasets):
+        context.add_meta_row(f"/{i}.dcm", ds)
+    return context.dataframe
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'instances':>10} {'concat (before)':>16} {'accumulate (after)':>19} {'speedup':>8}")
+    for size in args.sizes:
+        datasets = make_datasets(size)
+
+        t0 = time.perf_counter()
+        before = concat_per_instance(datasets)
+        t_before = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        after = accumulate(datasets)
+        t_after = time.perf_counter() - t0
+
+        assert before.shape == after.shape
+        print(f"{size:>10} {t_before:>15.3f}s {t_after:>18.3f}s {t_before / t_after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark of context message bodies: JSON with the DataFrame embedded as JSON (before) versus the msgpack
+wire format with columnar DataFrame encoding (after). Reports body size and encode/decode time.
+
+Run from base/DicomFlowLib/src: python -m DicomFlowLib.data_structures.contexts.benchmarks.bench_wire_format
+"""
+import argparse
+import time
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from .bench_meta_rows import make_datasets
+
+
+def make_context(instances: int, extra_tags: int) -> SCPContext:
+    context = SCPContext()
+    for i, ds in enumerate(make_datasets(instances, extra_tags=extra_tags)):
+        context.add_meta_row(f"/CT.{ds.SeriesInstanceUID}.{ds.SOPInstanceUID}.dcm", ds)
+    context.dataframe  # Build the DataFrame outside the timings
+    return context
+
+
+def best_of(function, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--extra-tags", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'instances':>10} {'format':>8} {'body size':>12} {'encode':>9} {'decode':>9}")
+    for size in args.sizes:
+        context = make_context(size, args.extra_tags)
+        for body_format in ["json", "msgpack"]:
+            body = context.to_body(body_format)
+            t_encode = best_of(lambda: context.to_body(body_format), args.repeats)
+            t_decode = best_of(lambda: SCPContext.from_body(body).dataframe, args.repeats)
+            print(f"{size:>10} {body_format:>8} {len(body) / 1e6:>10.2f}MB {t_encode:>8.3f}s {t_decode:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
 import json
 import uuid
 from io import StringIO
-from typing import Any, Dict
+from typing import Any, Dict, List, Iterable, Tuple, TYPE_CHECKING
 
 import pandas as pd
-from pydantic import BaseModel, field_serializer, ConfigDict
+from pydantic import BaseModel, field_serializer, ConfigDict, PrivateAttr, computed_field
 
-from DicomFlowLib.data_structures.flow import Flow, Destination
+from DicomFlowLib.data_structures.flow import Flow, Destination, trusted_flows
+from . import wire_format
 import pydicom
 
+if TYPE_CHECKING:
+    from DicomFlowLib.fs import MetadataStore
+
 
 def generate_uid():
     return str(uuid.uuid4())
@@ -28,29 +32,140 @@ class SCPContext(BaseContext):
 
     sender: Destination | None = None
     src_uid: str | None = None
-    dataframe: pd.DataFrame | None = None
+    dataframe_uid: str | None = None  # Set if the dataframe is kept in the metadata store instead of the body
+
+    # Store of the offloaded dataframe. Passed by services using claim-check metadata to from_body or offload_dataframe
+    _metadata_store: "MetadataStore | None" = PrivateAttr(default=None)
+    _dataframe: pd.DataFrame | None = PrivateAttr(default=None)
+    _meta_rows: List[Dict[str, str]] = PrivateAttr(default_factory=list)  # Rows not yet in _dataframe
+    _wire_format: str = PrivateAttr(default=wire_format.JSON)  # Format of the body the context was parsed from
+    # Serialized dataframe as (wire format, payload), parsed on first access and passed through if never accessed
+    _dataframe_payload: Tuple[str, Any] | None = PrivateAttr(default=None)
 
-    def __init__(self, dataframe: str | pd.DataFrame | None = None, **data: Any):
+    def __init__(self, dataframe: str | Dict | pd.DataFrame | None = None, **data: Any):
+        super().__init__(**data)
         if isinstance(dataframe, str):
-            dataframe = self.deserialize_dataframe(dataframe)
-        super().__init__(dataframe=dataframe, **data)
+            self._dataframe_payload = (wire_format.JSON, dataframe)
+        elif isinstance(dataframe, dict):  # Columnar encoding of the msgpack wire format
+            self._dataframe_payload = (wire_format.MSGPACK, dataframe)
+        else:
+            self._dataframe = dataframe
+
+    @classmethod
+    def from_body(cls, body: bytes, validate_flow: bool = True, metadata_store: "MetadataStore | None" = None):
+        """
+        Parses a message body in any of the wire formats. The dataframe is only parsed when accessed.
+        Services only routing the context can skip validate_flow, as the flow was validated when the context
+        was created. Services reading dataframes offloaded with claim check pass the metadata_store to load them from.
+        """
+        with trusted_flows(not validate_flow):
+            if wire_format.is_binary(body):
+                fields, dataframe = wire_format.decode(body)
+                context = cls(dataframe=dataframe, **fields)
+                context._wire_format = wire_format.MSGPACK
+            else:
+                context = cls(**json.loads(body.decode()))
+        context._metadata_store = metadata_store
+        return context
+
+    def to_body(self, body_format: str | None = None) -> bytes:
+        """
+        Serializes the context to a message body. Defaults to the format the context was parsed from, so
+        services answer in the format they receive.
+        """
+        body_format = body_format or self._wire_format
+        payload = self._dataframe_payload if not self._meta_rows else None
+        if body_format == wire_format.MSGPACK:
+            if self.dataframe_uid:
+                dataframe = None
+            elif payload is not None and payload[0] == wire_format.MSGPACK:
+                dataframe = payload[1]
+            else:
+                dataframe = self.dataframe
+            return wire_format.encode(fields=self.model_dump(mode="json", exclude={"dataframe"}),
+                                      dataframe=dataframe)
+        elif body_format == wire_format.JSON:
+            # An offloaded dataframe is not loaded just to be left out
+            if self.dataframe_uid:
+                return self.model_dump_json(exclude={"dataframe"}).encode()
+            elif payload is not None and payload[0] == wire_format.JSON:
+                # The unparsed dataframe string is put back in the object instead of being parsed and serialized
+                body = self.model_dump_json(exclude={"dataframe"}).encode()
+                return body[:-1] + b',"dataframe":' + json.dumps(payload[1]).encode() + b'}'
+            return self.model_dump_json().encode()
+        raise ValueError(f"Unknown wire format: {body_format}")
 
-    def add_meta_row(self, dcm_path: str, ds: pydicom.dataset.Dataset):
-        elems = {"dcm_path": dcm_path}
+    @property
+    def wire_format(self) -> str:
+        return self._wire_format
 
-        for elem in ds:
-            if elem.keyword == "PixelData":
-                continue
+    @computed_field
+    @property
+    def dataframe(self) -> pd.DataFrame | None:
+        if self._dataframe_payload is not None:
+            payload_format, payload = self._dataframe_payload
+            if payload_format == wire_format.MSGPACK:
+                self._dataframe = wire_format.decode_dataframe(payload)
             else:
-                elems[str(elem.keyword)] = str(elem.value)
+                self._dataframe = self.deserialize_dataframe(payload)
+            self._dataframe_payload = None
+
+        if self._dataframe is None and self.dataframe_uid:
+            if self._metadata_store is None:
+                raise Exception("Dataframe is in the metadata store, but no metadata store is set")
+            self._dataframe = self._metadata_store.get(self.dataframe_uid)
+
+        # Rows added with add_meta_row are only turned into a DataFrame when it is actually needed
+        if self._meta_rows:
+            self._dataframe = pd.concat([self._dataframe, pd.DataFrame(self._meta_rows)], ignore_index=True)
+            self._meta_rows = []
+        return self._dataframe
+
+    @dataframe.setter
+    def dataframe(self, dataframe: pd.DataFrame | None):
+        self._dataframe = dataframe
+        self._dataframe_payload = None
+        self._meta_rows = []
+        self.dataframe_uid = None
+
+    def offload_dataframe(self, metadata_store: "MetadataStore"):
+        """
+        Moves the dataframe to the metadata store, so only its uid is serialized.
+        """
+        if self.dataframe_uid:
+            return
+        dataframe = self.dataframe
+        if dataframe is not None:
+            self.dataframe_uid = metadata_store.put(dataframe)
+            self._metadata_store = metadata_store
+
+    def add_meta_row(self, dcm_path: str, ds: pydicom.dataset.Dataset, keywords: Iterable[str] | None = None):
+        if self.dataframe_uid:
+            self.dataframe = self.dataframe  # The stored dataframe no longer matches
+
+        elems = {"dcm_path": dcm_path}
+
+        if keywords is None:
+            for elem in ds:
+                if elem.keyword == "PixelData":
+                    continue
+                else:
+                    elems[str(elem.keyword)] = str(elem.value)
+        else:
+            # Only the requested elements are decoded
+            for keyword in keywords:
+                if keyword in ds:
+                    elems[keyword] = str(ds[keyword].value)
 
-        self.dataframe = pd.concat([self.dataframe, pd.DataFrame([elems])], ignore_index=True)
+        self._meta_rows.append(elems)
 
     def deserialize_dataframe(self, dataframe: str):
         return pd.read_json(StringIO(dataframe))
 
     @field_serializer('dataframe', when_used='json')
-    def serialize_dataframe(self, dataframe: pd.DataFrame) -> str:
+    def serialize_dataframe(self, dataframe: pd.DataFrame | None) -> str | None:
+        if dataframe is None:
+            return None
         return dataframe.to_json()
 
 
@@ -58,6 +173,7 @@ class FlowContext(SCPContext):
     flow: Flow
     mount_mapping: Dict[str, str] = {}
     active_model_idx: int | None = None
+    active_model_runtime: float | None = None  # Seconds the consumer spent running the active model
 
     def __init__(self, **data: Any):
         super().__init__(**data)
@@ -0,0 +1,122 @@
+import json
+import unittest
+import uuid
+from io import BytesIO
+
+import pandas as pd
+from pydicom.dataset import Dataset
+
+from DicomFlowLib.data_structures.contexts import SCPContext, wire_format
+from DicomFlowLib.fs import MetadataStore
+
+
+class MemoryFileStorage:
+    def __init__(self):
+        self.files = {}
+
+    def post(self, file):
+        uid = str(uuid.uuid4())
+        self.files[uid] = file.read()
+        return uid
+
+    def get(self, uid):
+        return BytesIO(self.files[uid])
+
+
+class TestSCPContext(unittest.TestCase):
+    @staticmethod
+    def make_dataset(modality: str, sop_instance_uid: str):
+        ds = Dataset()
+        ds.Modality = modality
+        ds.SOPInstanceUID = sop_instance_uid
+        return ds
+
+    def test_add_meta_row_builds_dataframe_on_read(self):
+        context = SCPContext()
+        self.assertIsNone(context.dataframe)
+
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"))
+        context.add_meta_row("/2.dcm", self.make_dataset("MR", "1.2.3.2"))
+        self.assertEqual(["/1.dcm", "/2.dcm"], list(context.dataframe["dcm_path"]))
+
+        context.add_meta_row("/3.dcm", self.make_dataset("CT", "1.2.3.3"))
+        self.assertEqual(["CT", "MR", "CT"], list(context.dataframe["Modality"]))
+
+    def test_add_meta_row_with_keywords(self):
+        context = SCPContext()
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"), keywords=["Modality", "SeriesDescription"])
+        self.assertEqual({"dcm_path", "Modality"}, set(context.dataframe.columns))
+
+    def test_json_round_trip(self):
+        context = SCPContext()
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"))
+
+        new_context = SCPContext(**json.loads(context.model_dump_json()))
+        self.assertEqual(context.uid, new_context.uid)
+        pd.testing.assert_frame_equal(context.dataframe, new_context.dataframe)
+
+    def test_unparsed_dataframe_is_passed_through(self):
+        context = SCPContext()
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"))
+
+        for body_format in wire_format.WIRE_FORMATS:
+            body = context.to_body(body_format)
+            self.assertEqual(body, SCPContext.from_body(body).to_body())
+
+    def test_msgpack_round_trip(self):
+        context = SCPContext()
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"))
+        context.add_meta_row("/2.dcm", self.make_dataset("CT", "1.2.3.2"))
+
+        body = context.to_body("msgpack")
+        self.assertEqual("msgpack", wire_format.wire_format_of(body))
+
+        new_context = SCPContext.from_body(body)
+        self.assertEqual(context.uid, new_context.uid)
+        pd.testing.assert_frame_equal(context.dataframe, new_context.dataframe)
+
+        # Answers in the format it was received in
+        self.assertEqual(body, new_context.to_body())
+        self.assertEqual("json", wire_format.wire_format_of(SCPContext.from_body(context.to_body()).to_body()))
+
+    def test_claim_check(self):
+        fs = MemoryFileStorage()
+        metadata_store = MetadataStore(file_storage=fs)
+        context = SCPContext()
+        context.add_meta_row("/1.dcm", self.make_dataset("CT", "1.2.3.1"))
+        context.offload_dataframe(metadata_store)
+        self.assertIn(context.dataframe_uid, fs.files)
+
+        for body_format in wire_format.WIRE_FORMATS:
+            body = context.to_body(body_format)
+            self.assertNotIn(b"1.2.3.1", body)
+
+            metadata_store.cache.clear()
+            new_context = SCPContext.from_body(body, metadata_store=metadata_store)
+            pd.testing.assert_frame_equal(context.dataframe, new_context.dataframe)
+
+        with self.assertRaises(Exception):  # No store to load it from
+            _ = SCPContext.from_body(body).dataframe
+
+        # Changing the dataframe drops the reference to the stored one
+        new_context.add_meta_row("/2.dcm", self.make_dataset("CT", "1.2.3.2"))
+        self.assertIsNone(new_context.dataframe_uid)
+        self.assertEqual(2, len(new_context.dataframe))
+
+    def test_metadata_store_returns_copies(self):
+        metadata_store = MetadataStore(file_storage=MemoryFileStorage())
+        dataframe = pd.DataFrame({"dcm_path": ["/1.dcm"], "Modality": ["CT"]})
+        uid = metadata_store.put(dataframe)
+        dataframe["Modality"] = "MR"  # Changes by the caller do not reach the cache
+
+        first = SCPContext.from_body(SCPContext(dataframe_uid=uid).to_body(), metadata_store=metadata_store)
+        first.dataframe["Modality"] = "RTSTRUCT"
+        second = SCPContext.from_body(SCPContext(dataframe_uid=uid).to_body(), metadata_store=metadata_store)
+        self.assertEqual(["CT"], list(second.dataframe["Modality"]))
+
+        # Contexts holding a store can be deep copied, and share it
+        self.assertIs(metadata_store, second.model_copy(deep=True)._metadata_store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Binary wire format of context message bodies.
+
+A binary body is MAGIC + a version byte + a msgpack map of the model fields and the dataframe. The dataframe is
+encoded column by column as a list of unique values and an array of codes into it, as DICOM metadata repeats the
+same values in most rows. Bodies without MAGIC are the JSON bodies of model_dump_json.
+"""
+from typing import Any, Dict, Tuple
+
+import msgpack
+import numpy as np
+import pandas as pd
+
+JSON = "json"
+MSGPACK = "msgpack"
+WIRE_FORMATS = (JSON, MSGPACK)
+
+CONTENT_TYPES = {
+    JSON: "application/json",
+    MSGPACK: "application/x-dicomflow-msgpack",
+}
+
+MAGIC = b"DFLC"
+VERSION = 1
+
+
+def is_binary(body: bytes) -> bool:
+    return body[:len(MAGIC)] == MAGIC
+
+
+def wire_format_of(body: bytes) -> str:
+    return MSGPACK if is_binary(body) else JSON
+
+
+def content_type_of(body: bytes) -> str:
+    return CONTENT_TYPES[wire_format_of(body)]
+
+
+def _default(obj):
+    # numpy scalars and other values msgpack does not know, e.g. Timestamps
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def encode_dataframe(dataframe: pd.DataFrame) -> Dict[str, Any]:
+    columns = []
+    for name in dataframe.columns:
+        codes, uniques = pd.factorize(dataframe[name], use_na_sentinel=False)
+        columns.append({"name": name,
+                        "dtype": str(dataframe[name].dtype),
+                        "values": list(uniques),
+                        "codes": codes.astype("<u4").tobytes()})
+    return {"index": list(dataframe.index), "columns": columns}
+
+
+def decode_dataframe(encoded: Dict[str, Any]) -> pd.DataFrame:
+    data = {}
+    for column in encoded["columns"]:
+        values = np.empty(len(column["values"]), dtype=object)
+        values[:] = column["values"]
+        codes = np.frombuffer(column["codes"], dtype="<u4")
+        series = pd.Series(values.take(codes), copy=False)
+        if column["dtype"] != "object":
+            series = series.astype(column["dtype"])
+        data[column["name"]] = series
+    dataframe = pd.DataFrame(data)
+    dataframe.index = encoded["index"]
+    return dataframe
+
+
+def encode(fields: Dict[str, Any], dataframe: pd.DataFrame | Dict[str, Any] | None) -> bytes:
+    """
+    dataframe is a DataFrame or a dataframe already encoded with encode_dataframe.
+    """
+    if isinstance(dataframe, pd.DataFrame):
+        dataframe = encode_dataframe(dataframe)
+    payload = {"fields": fields, "dataframe": dataframe}
+    return MAGIC + bytes([VERSION]) + msgpack.packb(payload, default=_default)
+
+
+def decode(body: bytes) -> Tuple[Dict[str, Any], Dict[str, Any] | None]:
+    """
+    Returns the model fields and the encoded dataframe, which is left to decode_dataframe when it is needed.
+    """
+    version = body[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire format version: {version}")
+
+    payload = msgpack.unpackb(body[len(MAGIC) + 1:], strict_map_key=False)
+    return payload["fields"], payload["dataframe"]
+
+
+def dumps_dataframe(dataframe: pd.DataFrame) -> bytes:
+    """
+    Standalone encoding of a DataFrame, used when it is stored outside the message body.
+    """
+    return MAGIC + bytes([VERSION]) + msgpack.packb(encode_dataframe(dataframe), default=_default)
+
+
+def loads_dataframe(data: bytes) -> pd.DataFrame:
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire format version: {version}")
+    return decode_dataframe(msgpack.unpackb(data[len(MAGIC) + 1:], strict_map_key=False))
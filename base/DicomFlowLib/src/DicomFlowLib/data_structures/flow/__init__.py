@@ -1,3 +1,4 @@
-from .flow import Flow
+from .flow import Flow, trusted_flows
 from .model import Model
-from .destination import Destination
\ No newline at end of file
+from .destination import Destination
+from .dag import FlowDAG, get_flow_dag
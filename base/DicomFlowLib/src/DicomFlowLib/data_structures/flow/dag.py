@@ -0,0 +1,94 @@
+import functools
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+from DicomFlowLib.data_structures.flow.model import Model
+
+# Input and output mount keys of each model - all the DAG depends on
+DAGKey = Tuple[Tuple[Tuple[str, ...], Tuple[str, ...]], ...]
+
+
+class FlowDAG:
+    """
+    Validated DAG of the models of a flow. Model i precedes model u if an output mount of i is an input mount of u.
+    Built once per distinct mount structure, see get_flow_dag.
+    """
+    def __init__(self, key: DAGKey):
+        self.key = key
+        self.inputs: List[Set[str]] = [set(inputs) for inputs, _ in key]
+        self.outputs: List[Set[str]] = [set(outputs) for _, outputs in key]
+
+        self.producers: Dict[str, List[int]] = {}  # Mount -> models writing it
+        self.consumers: Dict[str, List[int]] = {}  # Mount -> models reading it
+        for i, (inputs, outputs) in enumerate(key):
+            for mount in outputs:
+                self.producers.setdefault(mount, []).append(i)
+            for mount in inputs:
+                self.consumers.setdefault(mount, []).append(i)
+
+        self.adjacency: Dict[int, Set[int]] = {i: set() for i in range(len(key))}
+        for mount, producers in self.producers.items():
+            for i in producers:
+                self.adjacency[i].update(self.consumers.get(mount, []))
+
+        self.predecessor_counts: Dict[int, int] = {i: 0 for i in range(len(key))}
+        for successors in self.adjacency.values():
+            for u in successors:
+                self.predecessor_counts[u] += 1
+
+        self.topological_order = self.validate()
+
+    def sort_topologically(self) -> List[int]:
+        counts = dict(self.predecessor_counts)
+        ready = deque(i for i, count in counts.items() if count == 0)
+        order = []
+        while ready:
+            i = ready.popleft()
+            order.append(i)
+            for u in sorted(self.adjacency[i]):
+                counts[u] -= 1
+                if counts[u] == 0:
+                    ready.append(u)
+
+        if len(order) != len(self.key):
+            raise Exception("is not directed and acyclic")
+        return order
+
+    def validate(self) -> List[int]:
+        """
+        Raises if the models do not form a valid flow, otherwise returns the topological order.
+        """
+        all_inputs = set(self.consumers.keys())
+        all_outputs = set(self.producers.keys())
+
+        if len(self.producers.get("dst", [])) != 1:
+            all_output_mounts = [mount for _, outputs in self.key for mount in outputs]
+            raise Exception(f"'dst' must be used only once! Found outputs: {all_output_mounts}")
+        if "dst" in all_inputs:
+            raise Exception("'dst' may not be used as input - use only for outputs only")
+        if "src" in all_outputs:
+            raise Exception("'src' may not be used output - use only for inputs only")
+        order = self.sort_topologically()
+        if not all_inputs.symmetric_difference(all_outputs) == {"src", "dst"}:
+            resid = all_inputs.symmetric_difference(all_outputs)
+            resid.discard("src")
+            resid.discard("dst")
+            raise Exception(f"Invalid mapping - don't know what to do with {resid}")
+        return order
+
+
+def dag_key(models: List[Model]) -> DAGKey:
+    return tuple((tuple(sorted(m.input_mounts.keys())), tuple(sorted(m.output_mounts.keys()))) for m in models)
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_flow_dag(key: DAGKey) -> FlowDAG:
+    return FlowDAG(key)
+
+
+def get_flow_dag(models: List[Model]) -> FlowDAG:
+    """
+    Returns the validated DAG of models. Cached on the mount structure, so flows parsed again from messages reuse it.
+    Raises if the models do not form a valid DAG.
+    """
+    return _get_flow_dag(dag_key(models))
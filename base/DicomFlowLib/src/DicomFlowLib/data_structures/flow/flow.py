@@ -1,11 +1,29 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Dict, List, Any
 
-import networkx
 import yaml
 from pydantic import BaseModel, Field
 
 from DicomFlowLib.data_structures.flow.model import Model
 from DicomFlowLib.data_structures.flow.destination import Destination
+from DicomFlowLib.data_structures.flow.dag import FlowDAG, get_flow_dag
+
+# If set, flows are not validated as DAGs on construction. See trusted_flows
+_trusted = ContextVar("trusted_flows", default=False)
+
+
+@contextmanager
+def trusted_flows(trusted: bool = True):
+    """
+    Skips the DAG validation of flows constructed within the context, e.g. flows parsed from messages of services
+    that already validated them.
+    """
+    token = _trusted.set(trusted)
+    try:
+        yield
+    finally:
+        _trusted.reset(token)
 
 
 class Flow(BaseModel):
@@ -21,44 +39,18 @@ class Flow(BaseModel):
 
     def __init__(self, **data: Any):
         super().__init__(**data)
-        assert self.is_valid_dag()
+        if not _trusted.get():
+            assert self.is_valid_dag()
 
-    def is_valid_dag(self):
-        inputs = set()
-        outputs = set()
-        all_output_mounts = []
-        G = networkx.MultiDiGraph()
-        G.add_nodes_from([i for i, m in enumerate(self.models)])
+    @property
+    def dag(self) -> FlowDAG:
+        return get_flow_dag(self.models)
 
-        for i in range(len(self.models)):
-            all_output_mounts += self.models[i].output_mounts.keys()
-            for u in range(len(self.models)):
-                outputs_i = set(self.models[i].output_mounts.keys())
-                outputs = outputs.union(outputs_i)
-                inputs_u = set(self.models[u].input_mounts.keys())
-                inputs = inputs.union(inputs_u)
-
-                edges = outputs_i.intersection(inputs_u)
-                for e in edges:
-                    G.add_edge(i, u, name=e)
-        try:
-            if all_output_mounts.count("dst") != 1:
-                raise Exception(f"'dst' must be used only once! Found outputs: {all_output_mounts}")
-            if "dst" in inputs:
-                raise Exception("'dst' may not be used as input - use only for outputs only")
-            if "src" in outputs:
-                raise Exception("'src' may not be used output - use only for inputs only")
-            if not networkx.is_directed_acyclic_graph(G):
-                raise Exception("is not directed and acyclic")
-            if not inputs.symmetric_difference(outputs) == {"src", "dst"}:
-                resid = inputs.symmetric_difference(outputs)
-                resid.remove("src")
-                resid.remove("dst")
-                raise Exception(f"Invalid mapping - don't know what to do with {resid}")
-        except Exception as e:
-            raise e
+    def is_valid_dag(self):
+        self.dag  # Raises if invalid. Cached, so only the first flow with this structure is validated
         return True
 
+
 if __name__ == "__main__":
     file = "DicomFlowLib/data_structures/flow/tests/test_flows/dag_flow.yaml"
     with open(file) as r:
@@ -0,0 +1,46 @@
+import os
+import unittest
+
+import yaml
+
+from DicomFlowLib.data_structures.flow import Flow, Model, get_flow_dag
+
+TEST_FLOWS = os.path.join(os.path.dirname(__file__), "test_flows")
+
+
+class TestFlowDAG(unittest.TestCase):
+    @staticmethod
+    def make_model(inputs, outputs):
+        return Model(docker_kwargs={"image": "busybox"},
+                     input_mounts={k: f"/{k}" for k in inputs},
+                     output_mounts={k: f"/{k}" for k in outputs})
+
+    def test_dag_of_flow(self):
+        with open(os.path.join(TEST_FLOWS, "one_job.yaml")) as r:
+            flow = Flow(**yaml.safe_load(r))
+
+        dag = flow.dag
+        self.assertEqual([0, 1, 2], dag.topological_order)
+        self.assertEqual({1, 2}, dag.adjacency[0])
+        self.assertEqual({0: 0, 1: 1, 2: 2}, dag.predecessor_counts)
+        self.assertEqual([0], dag.producers["STRUCT"])
+        self.assertEqual([2], dag.consumers["CT"])
+
+    def test_dag_is_cached(self):
+        models = [self.make_model(["src"], ["a"]), self.make_model(["a"], ["dst"])]
+        self.assertIs(get_flow_dag(models), get_flow_dag([m.model_copy(deep=True) for m in models]))
+
+    def test_invalid_dags(self):
+        invalid = [
+            [self.make_model(["src"], ["a"])],  # No dst
+            [self.make_model(["src", "b"], ["a"]), self.make_model(["a"], ["b", "dst"])],  # Cycle
+            [self.make_model(["src"], ["a", "dst"])],  # Unused output
+            [self.make_model(["src", "dst"], ["dst"])],  # dst as input
+        ]
+        for models in invalid:
+            with self.assertRaises(Exception):
+                get_flow_dag(models)
+
+
+if __name__ == '__main__':
+    unittest.main()
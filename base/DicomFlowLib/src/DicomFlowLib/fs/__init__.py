@@ -1,3 +1,4 @@
 from .file_storage_client import FileStorageClient
 from .file_storage_router import FileStorageRouter
 from .file_manager import FileManager
+from .metadata_store import MetadataStore
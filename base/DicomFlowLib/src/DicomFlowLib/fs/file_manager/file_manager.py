@@ -1,10 +1,13 @@
 import hashlib
 import logging
 import os
+import shutil
 import threading
 import uuid
+from typing import Dict
 
 from .janitor import FileJanitor
+from ..tar_utils import derive_tar
 
 
 def hash_file(path, buffer_size=65536):
@@ -64,11 +67,34 @@ class FileManager(threading.Thread):
         p = self.get_file_path(uid)
         with open(p, "wb") as writer:
             self.logger.debug(f"Writing file with uid: {uid} to path: {p}")
-            writer.write(tar_file.file.read())
+            shutil.copyfileobj(tar_file.file, writer)
 
         tar_file.file.close()
         return uid
 
+    def derive_file(self, uid: str, members: Dict[str, str]):
+        """
+        Creates a new file from the tar members of uid listed in members, renamed to members[name]. Raises
+        FileNotFoundError if members are missing from uid. The file is written under a temporary name and only
+        appears on new_uid when complete.
+        """
+        new_uid = str(uuid.uuid4())
+        self.logger.debug(f"Deriving file on uid: {new_uid} from uid: {uid} with {len(members)} members")
+
+        p = self.get_file_path(new_uid)
+        tmp = self.get_file_path(f".{new_uid}.part")  # Keeps the suffix, so the janitor can handle it
+        try:
+            with open(self.get_file_path(uid), "rb") as src, open(tmp, "wb") as dst:
+                copied = derive_tar(src=src, dst=dst, members=members)
+            if copied != len(members):
+                raise FileNotFoundError(f"{len(members) - copied} of {len(members)} members not in {uid}")
+            os.replace(tmp, p)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return new_uid
+
     def get_file_path(self, uid):
         return os.path.join(self.base_dir, uid + self.suffix)
 
@@ -1,6 +1,9 @@
 import logging
 import os
-from io import BytesIO
+import shutil
+import tempfile
+import uuid
+from typing import BinaryIO, Dict
 
 import requests
 import urllib.parse
@@ -13,6 +16,8 @@ class FileStorageClient:
                  file_storage_url: str,
                  local_cache: str | None = None,
                  suffix: str = ".tar",
+                 chunk_size: int = 1048576,
+                 spool_max_size: int = 67108864,
                  log_level: int = 20):
 
         self.suffix = suffix
@@ -20,12 +25,18 @@ class FileStorageClient:
         self.logger.setLevel(log_level)
 
         self.url = file_storage_url
+        self.chunk_size = chunk_size
+        self.spool_max_size = spool_max_size  # Downloads larger than this are spooled to disk
         self.local_cache = local_cache
         if self.local_cache:
             os.makedirs(self.local_cache, exist_ok=True)
 
-    def post(self, file: BytesIO) -> str:
-        res = requests.post(self.url, files={"tar_file": file})
+    def post(self, file: BinaryIO) -> str:
+        # The multipart body is streamed in chunks, so the file is never held in memory as a whole
+        boundary = uuid.uuid4().hex
+        res = requests.post(self.url,
+                            data=self.iter_multipart_body(file, boundary),
+                            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
         if res.ok:
             uid = res.json()
             if self.local_cache:
@@ -37,6 +48,14 @@ class FileStorageClient:
             self.logger.error(res.json())
             res.raise_for_status()
 
+    def iter_multipart_body(self, file: BinaryIO, boundary: str, field_name: str = "tar_file"):
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="{field_name}"; filename="{field_name}"\r\n'
+               f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        while chunk := file.read(self.chunk_size):
+            yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
     def clone(self, uid):
         self.logger.debug(f"Clone file on uid: {uid}")
         res = requests.put(self.url, params={"uid": uid})
@@ -52,6 +71,21 @@ class FileStorageClient:
             self.logger.error(str(res.json()))
             res.raise_for_status()
 
+    def derive(self, uid: str, members: Dict[str, str]) -> str:
+        """
+        Creates a new file on the file storage from the tar members of uid listed in members, renamed to
+        members[name], without transferring the data. Returns the uid of the new file.
+        """
+        self.logger.debug(f"Derive file from uid: {uid}")
+        res = requests.post(urllib.parse.urljoin(self.url, "derive/"), json={"uid": uid, "members": members})
+        if res.ok:
+            return res.json()
+        elif res.status_code == 404:
+            raise FileNotFoundError
+        else:
+            self.logger.error(str(res.json()))
+            res.raise_for_status()
+
     def get_hash(self, uid: str):
         res = requests.get(urllib.parse.urljoin(self.url, "hash"), params={"uid": uid})
         if res.ok:
@@ -77,9 +111,12 @@ class FileStorageClient:
                 if self.remote_local_match(uid):
                     return open(self.get_file_path(uid), "rb")
 
-        res = requests.get(self.url, params={"uid": uid})
+        res = requests.get(self.url, params={"uid": uid}, stream=True)
         if res.ok:
-            file = BytesIO(res.content)
+            file = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+            for chunk in res.iter_content(chunk_size=self.chunk_size):
+                file.write(chunk)
+            file.seek(0)
             if self.local_cache:
                 self.write_file_to_disk(uid, file)
             return file
@@ -124,11 +161,11 @@ class FileStorageClient:
 
         return remote_hash == local_hash
 
-    def write_file_to_disk(self, uid: str, file: BytesIO):
+    def write_file_to_disk(self, uid: str, file: BinaryIO):
         p = self.get_file_path(uid)
         file.seek(0)
         with open(p, "wb") as writer:
             self.logger.debug(f"Writing file with uid: {uid} to path: {p}")
-            writer.write(file.read())
+            shutil.copyfileobj(file, writer, self.chunk_size)
         file.seek(0)
         return p
@@ -1,11 +1,18 @@
 import logging
+from typing import Dict
 
 from fastapi import File, UploadFile, HTTPException, APIRouter
 from fastapi.responses import FileResponse
+from pydantic import BaseModel
 
 from DicomFlowLib.fs.file_manager import FileManager
 
 
+class DeriveRequest(BaseModel):
+    uid: str
+    members: Dict[str, str]  # Member name in uid -> member name in the derived file
+
+
 class FileStorageRouter(APIRouter):
     def __init__(self,
                  file_manager: FileManager,
@@ -13,6 +20,7 @@ class FileStorageRouter(APIRouter):
                  allow_get: bool = True,
                  allow_clone: bool = True,
                  allow_delete: bool = True,
+                 allow_derive: bool = True,
                  log_level: int = 20):
         super().__init__()
 
@@ -25,6 +33,7 @@ class FileStorageRouter(APIRouter):
         self.allow_get = allow_get
         self.allow_delete = allow_delete
         self.allow_clone = allow_clone
+        self.allow_derive = allow_derive
 
         @self.post("/")
         def post(tar_file: UploadFile = File(...)):
@@ -40,6 +49,17 @@ class FileStorageRouter(APIRouter):
                 raise HTTPException(404, "FileNotFoundError")
             return self.file_manager.clone_file(uid)
 
+        @self.post("/derive/")
+        def derive(request: DeriveRequest):
+            if not self.allow_derive:
+                raise HTTPException(status_code=405, detail="Method not allowed")
+            if not self.file_manager.file_exists(request.uid):
+                raise HTTPException(404, "FileNotFoundError")
+            try:
+                return self.file_manager.derive_file(request.uid, request.members)
+            except FileNotFoundError as e:  # Members missing from the file
+                raise HTTPException(404, str(e))
+
         @self.delete("/")
         def delete(uid: str):
             if not self.allow_delete:
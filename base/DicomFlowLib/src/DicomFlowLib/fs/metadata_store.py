@@ -0,0 +1,55 @@
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+
+from DicomFlowLib.data_structures.contexts.wire_format import dumps_dataframe, loads_dataframe
+from .file_storage_client import FileStorageClient
+
+
+class MetadataStore:
+    """
+    Keeps context metadata DataFrames in the file storage, so messages only carry their uid (claim check).
+    Recently used DataFrames are cached in memory. The cache holds copies and get() returns a copy, so callers may
+    modify the DataFrames they put or get.
+    """
+    def __init__(self, file_storage: FileStorageClient, cache_size: int = 32, log_level: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        self.fs = file_storage
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, pd.DataFrame] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self  # Shared by the contexts holding it, also when they are copied
+
+    def _cache(self, uid: str, dataframe: pd.DataFrame):
+        with self.lock:
+            self.cache[uid] = dataframe
+            self.cache.move_to_end(uid)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def put(self, dataframe: pd.DataFrame) -> str:
+        uid = self.fs.post(BytesIO(dumps_dataframe(dataframe)))
+        self.logger.debug(f"Stored metadata on uid: {uid}")
+        self._cache(uid, dataframe.copy())
+        return uid
+
+    def get(self, uid: str) -> pd.DataFrame:
+        with self.lock:
+            if uid in self.cache:
+                self.cache.move_to_end(uid)
+                return self.cache[uid].copy()
+
+        self.logger.debug(f"Loading metadata from uid: {uid}")
+        file = self.fs.get(uid)
+        try:
+            dataframe = loads_dataframe(file.read())
+        finally:
+            file.close()
+        self._cache(uid, dataframe.copy())
+        return dataframe
@@ -0,0 +1,21 @@
+import tarfile
+from typing import BinaryIO, Dict
+
+
+def derive_tar(src: BinaryIO, dst: BinaryIO, members: Dict[str, str]) -> int:
+    """
+    Copies the members of the tar in src listed in members into a new tar written to dst, renamed to
+    members[name]. Reads src in one sequential pass. Members not in src are skipped. Returns the number of
+    members copied.
+    """
+    copied = 0
+    with tarfile.open(fileobj=src, mode="r|") as src_tar, tarfile.open(fileobj=dst, mode="w") as dst_tar:
+        for member in src_tar:
+            new_name = members.get(member.name)
+            if new_name is None:
+                continue
+            info = tarfile.TarInfo(new_name)
+            info.size = member.size
+            dst_tar.addfile(info, src_tar.extractfile(member))
+            copied += 1
+    return copied
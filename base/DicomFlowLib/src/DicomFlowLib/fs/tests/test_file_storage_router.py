@@ -0,0 +1,89 @@
+import os
+import tarfile
+import tempfile
+import unittest
+from io import BytesIO
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from DicomFlowLib.fs import FileManager, FileStorageRouter
+
+
+class TestFileStorageRouter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+        app = FastAPI()
+        self.file_managers = {}
+        for prefix, allow_derive in (("/files", True), ("/static", False)):
+            file_manager = FileManager(base_dir=os.path.join(self.tmp_dir.name, prefix.strip("/")),
+                                       delete_file_after=3600,
+                                       delete_run_interval=0.05)
+            self.addCleanup(file_manager.file_janitor.join)
+            self.addCleanup(file_manager.file_janitor.stop)
+            self.file_managers[prefix] = file_manager
+            app.include_router(FileStorageRouter(file_manager=file_manager, allow_derive=allow_derive),
+                               prefix=prefix)
+        self.client = TestClient(app)
+
+    @staticmethod
+    def make_tar(paths):
+        file = BytesIO()
+        with tarfile.open(fileobj=file, mode="w") as tf:
+            for path in paths:
+                info = tarfile.TarInfo(path)
+                info.size = len(path)
+                tf.addfile(info, BytesIO(path.encode()))
+        return file.getvalue()
+
+    def post(self, prefix, data: bytes):
+        res = self.client.post(f"{prefix}/", files={"tar_file": ("tar_file", data)})
+        self.assertEqual(200, res.status_code)
+        return res.json()
+
+    def files_on_disk(self, prefix):
+        return sorted(os.listdir(self.file_managers[prefix].base_dir))
+
+    def test_derive(self):
+        uid = self.post("/files", self.make_tar(["/CT.1.1.dcm", "/MR.2.2.dcm"]))
+        res = self.client.post("/files/derive/", json={"uid": uid, "members": {"/CT.1.1.dcm": "/CT/1.dcm"}})
+        self.assertEqual(200, res.status_code)
+
+        res = self.client.get("/files/", params={"uid": res.json()})
+        with tarfile.open(fileobj=BytesIO(res.content)) as tf:
+            self.assertEqual({"/CT/1.dcm": b"/CT.1.1.dcm"}, {m.name: tf.extractfile(m).read() for m in tf})
+
+    def test_derive_missing_member(self):
+        uid = self.post("/files", self.make_tar(["/CT.1.1.dcm"]))
+        before = self.files_on_disk("/files")
+        res = self.client.post("/files/derive/", json={"uid": uid, "members": {"/CT.1.1.dcm": "/CT/1.dcm",
+                                                                               "/MR.2.2.dcm": "/MR/2.dcm"}})
+        self.assertEqual(404, res.status_code)
+        self.assertEqual(before, self.files_on_disk("/files"))  # Nothing left behind
+
+        res = self.client.post("/files/derive/", json={"uid": "unknown", "members": {}})
+        self.assertEqual(404, res.status_code)
+
+    def test_derive_truncated_source(self):
+        data = self.make_tar(["/CT.1.1.dcm", "/MR.2.2.dcm"])
+        uid = self.post("/files", data[:600])  # Cut in the data of the first member
+        before = self.files_on_disk("/files")
+        client = TestClient(self.client.app, raise_server_exceptions=False)
+        res = client.post("/files/derive/", json={"uid": uid, "members": {"/CT.1.1.dcm": "/CT/1.dcm"}})
+        self.assertEqual(500, res.status_code)
+        self.assertEqual(before, self.files_on_disk("/files"))
+
+    def test_derive_not_allowed(self):
+        file_manager = self.file_managers["/static"]
+        uid = "study"
+        with open(file_manager.get_file_path(uid), "wb") as w:
+            w.write(self.make_tar(["/CT.1.1.dcm"]))
+        res = self.client.post("/static/derive/", json={"uid": uid, "members": {"/CT.1.1.dcm": "/CT/1.dcm"}})
+        self.assertEqual(405, res.status_code)
+        self.assertEqual(["study.tar"], self.files_on_disk("/static"))
+
+
+if __name__ == '__main__':
+    unittest.main()
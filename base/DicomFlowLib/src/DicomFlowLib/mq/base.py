@@ -6,6 +6,8 @@ import time
 import pika
 from pika import channel, connection
 
+from DicomFlowLib.data_structures.contexts.wire_format import content_type_of
+
 
 class MQBase(threading.Thread):
     def __init__(self,
@@ -204,7 +206,8 @@ class MQBase(threading.Thread):
             body=body,
             properties=pika.BasicProperties(
                 reply_to=reply_to,
-                priority=priority
+                priority=priority,
+                content_type=content_type_of(body)  # Tells readers the wire format of the body
             )
         )
 
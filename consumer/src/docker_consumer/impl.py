@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import shutil
@@ -47,13 +46,15 @@ class DockerConsumer:
         self.cli.close()
 
     def mq_entrypoint(self, basic_deliver, body) -> Iterable[PublishContext]:
-        fc = FlowContext(**json.loads(body.decode()))
+        fc = FlowContext.from_body(body)
 
         self.logger.info(f"Spinning up flow")
+        t0 = time.monotonic()
         fc = self.exec_model(flow_context=fc)
+        fc.active_model_runtime = time.monotonic() - t0  # Runtime history of the scheduler
         self.logger.info(f"Finished flow")
 
-        return [PublishContext(body=fc.model_dump_json().encode(), routing_key=self.pub_routing_key_success)]
+        return [PublishContext(body=fc.to_body(), routing_key=self.pub_routing_key_success)]
 
     def exec_model(self,
                    flow_context: FlowContext) -> FlowContext:
@@ -32,7 +32,8 @@ class Main:
                                             base_dir=config["FILE_STORAGE_STATIC_DIR"]),
                 "allow_post": False,
                 "allow_clone": False,
-                "allow_delete": False
+                "allow_delete": False,
+                "allow_derive": False
             }
         }
         self.fs = FileStorageServer(host=config["FILE_STORAGE_HOST"],
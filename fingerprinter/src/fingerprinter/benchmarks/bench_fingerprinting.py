@@ -0,0 +1,145 @@
+"""
+Benchmark suite of the fingerprinting steps on a synthetic SCPContext and a synthetic flow directory of
+configurable size. Times parse_fingerprints, slice_dataframe_to_triggers, TriggerEngine.match and
+generate_flow_specific_tar separately, and lists the flows with the most expensive triggers.
+
+Results can be written with --output and compared against an earlier run with --baseline. The exit code is 1 if a
+step is slower than the baseline by more than --max-regression.
+
+Run from fingerprinter/src: python -m fingerprinter.benchmarks.bench_fingerprinting --flows 200 --instances 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import yaml
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from .bench_fp_throughput import make_study_tar
+from .bench_triggers import make_flow_dicts, make_study
+from ..fp_utils import generate_flow_specific_tar, parse_fingerprints, slice_dataframe_to_triggers
+from ..trigger_engine import TriggerEngine
+
+
+def write_flow_directory(flow_directory: str, flows: int, seed: int):
+    for flow in make_flow_dicts(flows, seed):
+        with open(os.path.join(flow_directory, f"{flow['name']}.yaml"), "w") as w:
+            yaml.safe_dump(flow, w)
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def best_of(repeat: int, func, *args, **kwargs):
+    result, elapsed = None, float("inf")
+    for _ in range(repeat):
+        result, t = timed(func, *args, **kwargs)
+        elapsed = min(elapsed, t)
+    return result, elapsed
+
+
+def run(args):
+    study = make_study(args.instances)
+    scp_context = SCPContext.from_body(SCPContext(src_uid="bench", dataframe=study).to_body())
+    dataframe = scp_context.dataframe
+    tar = make_study_tar(study, args.instance_size)
+
+    with tempfile.TemporaryDirectory() as flow_directory:
+        write_flow_directory(flow_directory, args.flows, args.seed)
+        flows, t_parse = best_of(args.repeat, lambda: list(parse_fingerprints(flow_directory)))
+
+    per_flow = []
+    for flow in flows:
+        times = []
+        for _ in range(args.repeat):
+            df = dataframe.copy()
+            sliced, t = timed(slice_dataframe_to_triggers, df, flow.triggers)
+            times.append(t)
+        per_flow.append((min(times), flow, sliced))
+
+    engine, t_compile = best_of(args.repeat, TriggerEngine, flows)
+    _, t_match = best_of(args.repeat, engine.match, dataframe)
+
+    tar_times = []
+    for _, flow, sliced in per_flow:
+        if sliced is None:
+            continue
+        tar_file, t = timed(generate_flow_specific_tar, BytesIO(tar), sliced, flow.tar_subdir)
+        tar_file.close()
+        tar_times.append(t)
+
+    slice_times = [t for t, _, _ in per_flow]
+    results = {
+        "parse_fingerprints": t_parse,
+        "slice_dataframe_to_triggers": sum(slice_times),
+        "trigger_engine_compile": t_compile,
+        "trigger_engine_match": t_match,
+        "generate_flow_specific_tar": sum(tar_times),
+    }
+
+    print(f"{args.flows} flows x {args.instances} instances ({len(tar) / 1e6:.1f} MB tar), "
+          f"{len(tar_times)} matching flows, best of {args.repeat}")
+    for step, t in results.items():
+        print(f"{step:>30}: {t:9.4f}s")
+
+    print("\nPer flow slice_dataframe_to_triggers:")
+    print(f"{'mean':>30}: {statistics.mean(slice_times) * 1000:9.3f}ms")
+    print(f"{'median':>30}: {statistics.median(slice_times) * 1000:9.3f}ms")
+    print(f"{'max':>30}: {max(slice_times) * 1000:9.3f}ms")
+    if tar_times:
+        print(f"{'generate_flow_specific_tar mean':>30}: {statistics.mean(tar_times) * 1000:9.3f}ms")
+
+    print(f"\nSlowest {args.top} flows:")
+    for t, flow, sliced in sorted(per_flow, key=lambda x: x[0], reverse=True)[:args.top]:
+        matched = "match" if sliced is not None else "no match"
+        print(f"{t * 1000:9.3f}ms {flow.name} ({matched}): {flow.triggers}")
+    return results
+
+
+def compare(results, baseline, max_regression: float, min_time: float) -> bool:
+    ok = True
+    print(f"\nCompared to baseline (max regression {max_regression:.2f}x):")
+    for step, t in results.items():
+        if step not in baseline or max(t, baseline[step]) < min_time:  # Too short to compare reliably
+            continue
+        ratio = t / baseline[step] if baseline[step] else 1.0
+        regressed = ratio > max_regression
+        ok = ok and not regressed
+        print(f"{step:>30}: {ratio:6.2f}x{' REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=200)
+    parser.add_argument("--instances", type=int, default=2000)
+    parser.add_argument("--instance-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="Write the step timings to this json file")
+    parser.add_argument("--baseline", help="Compare the step timings to this json file")
+    parser.add_argument("--max-regression", type=float, default=1.25)
+    parser.add_argument("--min-time", type=float, default=0.001, help="Steps faster than this are not compared")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as w:
+            json.dump(results, w, indent=2)
+    if args.baseline:
+        with open(args.baseline) as r:
+            if not compare(results, json.load(r), args.max_regression, args.min_time):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
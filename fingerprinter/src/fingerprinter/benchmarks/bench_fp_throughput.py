@@ -0,0 +1,124 @@
+"""
+Throughput benchmark of Fingerprinter.mq_entrypoint with studies in flight concurrently, as MQSub does with a
+prefetch count above 1. The file storage is replaced by an in-memory stand-in with a configurable latency, so the
+numbers show how much of the I/O wait is overlapped.
+
+Run from fingerprinter/src: python -m fingerprinter.benchmarks.bench_fp_throughput --prefetch 1 4 --flow-workers 1 4
+"""
+import argparse
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import yaml
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from .bench_triggers import make_study
+from ..impl import Fingerprinter
+
+
+class FileStorageStandIn:
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth  # Bytes per second
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def transfer(self, size: int):
+        time.sleep(self.latency + size / self.bandwidth)
+
+    def post(self, file) -> str:
+        data = file.read()
+        self.transfer(len(data))
+        uid = str(uuid.uuid4())
+        with self.lock:
+            self.files[uid] = data
+        return uid
+
+    def get(self, uid: str):
+        data = self.files[uid]
+        self.transfer(len(data))
+        return BytesIO(data)
+
+    def derive(self, uid: str, members) -> str:
+        self.transfer(0)
+        return str(uuid.uuid4())
+
+
+def make_study_tar(dataframe, instance_size: int) -> bytes:
+    payload = os.urandom(instance_size)
+    file = BytesIO()
+    with tarfile.open(fileobj=file, mode="w") as tf:
+        for path in dataframe["dcm_path"]:
+            info = tarfile.TarInfo(path)
+            info.size = instance_size
+            tf.addfile(info, BytesIO(payload))
+    return file.getvalue()
+
+
+def write_flows(flow_directory: str, flows: int):
+    modalities = ["CT", "MR", "RTSTRUCT", "PT"]
+    for i in range(flows):
+        with open(os.path.join(flow_directory, f"flow_{i}.yaml"), "w") as w:
+            yaml.safe_dump({"name": f"flow_{i}",
+                            "triggers": [{"Modality": [modalities[i % len(modalities)]]}],
+                            "models": [{"docker_kwargs": {"image": "busybox"}}]}, w)
+
+
+def run(fs, flow_directory, bodies, prefetch: int, flow_workers: int, server_side_derive: bool) -> float:
+    fp = Fingerprinter(file_storage=fs,
+                       flow_directory=flow_directory,
+                       routing_key_success="success",
+                       routing_key_fail="fail",
+                       server_side_derive=server_side_derive,
+                       flow_workers=flow_workers,
+                       log_level=40)
+    fp.get_trigger_engine()  # Load the flows outside the timing
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=prefetch) as consumers:
+        for results in consumers.map(lambda body: fp.mq_entrypoint(None, body), bodies):
+            assert results
+    elapsed = time.perf_counter() - t0
+    fp.flow_executor.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--studies", type=int, default=16)
+    parser.add_argument("--instances", type=int, default=200)
+    parser.add_argument("--instance-size", type=int, default=65536)
+    parser.add_argument("--flows", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per file storage request")
+    parser.add_argument("--bandwidth", type=float, default=200e6, help="File storage bytes per second")
+    parser.add_argument("--prefetch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--flow-workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--server-side-derive", action="store_true")
+    args = parser.parse_args()
+
+    fs = FileStorageStandIn(latency=args.latency, bandwidth=args.bandwidth)
+    study = make_study(args.instances)
+    tar = make_study_tar(study, args.instance_size)
+    bodies = [SCPContext(src_uid=fs.post(BytesIO(tar)), dataframe=study, sender={"host": "bench", "port": 104, "ae_title": "BENCH"}).to_body()
+              for _ in range(args.studies)]
+
+    with tempfile.TemporaryDirectory() as flow_directory:
+        write_flows(flow_directory, args.flows)
+        print(f"{args.studies} studies x {args.instances} instances ({len(tar) / 1e6:.1f} MB), {args.flows} flows, "
+              f"{args.latency * 1000:.0f} ms latency, {args.bandwidth / 1e6:.0f} MB/s")
+        baseline = None
+        for prefetch in args.prefetch:
+            for flow_workers in args.flow_workers:
+                elapsed = run(fs, flow_directory, bodies, prefetch, flow_workers, args.server_side_derive)
+                baseline = baseline or elapsed
+                print(f"prefetch {prefetch:3d}, flow workers {flow_workers:3d}: {elapsed:7.2f}s, "
+                      f"{args.studies / elapsed:6.2f} studies/s ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of trigger matching in the fingerprinter: slice_dataframe_to_triggers per flow (before) versus one
+TriggerEngine pass over all flows (after), on synthetic flows and a synthetic study.
+
+Run from fingerprinter/src: python -m fingerprinter.benchmarks.bench_triggers --flows 500 --instances 5000
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from DicomFlowLib.data_structures.flow import Flow
+from ..fp_utils import slice_dataframe_to_triggers
+from ..trigger_engine import TriggerEngine
+
+SERIES = [
+    {"Modality": "CT", "SeriesDescription": "Thorax 2.0 B31f", "BodyPartExamined": "CHEST"},
+    {"Modality": "CT", "SeriesDescription": "Pelvis 3.0 I30f", "BodyPartExamined": "PELVIS"},
+    {"Modality": "MR", "SeriesDescription": "T2 TSE tra", "BodyPartExamined": "PELVIS"},
+    {"Modality": "MR", "SeriesDescription": "T1 VIBE dixon", "BodyPartExamined": "HEADNECK"},
+    {"Modality": "RTSTRUCT", "SeriesDescription": "Structures", "BodyPartExamined": "CHEST"},
+]
+
+PATTERNS = {
+    "Modality": ["CT", "MR", "RTSTRUCT", "PT", "~RTSTRUCT"],
+    "SeriesDescription": ["Thorax", "Pelvis", "T2", "T1", "B31f", "~dixon", ".*tra$", "(?i)structures"],
+    "BodyPartExamined": ["CHEST", "PELVIS", "HEAD", "~PELVIS"],
+    "StudyDescription": ["RT", "Planning"],
+}
+
+
+def make_study(instances: int) -> pd.DataFrame:
+    rows = []
+    for i in range(instances):
+        series = SERIES[i % len(SERIES)]
+        rows.append({"dcm_path": f"/{i}.dcm",
+                     "SOPInstanceUID": f"1.2.3.{i}",
+                     "SeriesInstanceUID": f"1.2.4.{i % len(SERIES)}",
+                     "StudyDescription": "RT Planning",
+                     "InstanceNumber": str(i),
+                     **series})
+    return pd.DataFrame(rows)
+
+
+def make_flow_dicts(flows: int, seed: int = 0):
+    rng = random.Random(seed)
+    result = []
+    for i in range(flows):
+        triggers = []
+        for _ in range(rng.randint(1, 3)):
+            keywords = rng.sample(list(PATTERNS.keys()), rng.randint(1, 2))
+            triggers.append({kw: rng.sample(PATTERNS[kw], rng.randint(1, 2)) for kw in keywords})
+        result.append({"name": f"flow_{i}",
+                       "triggers": triggers,
+                       "models": [{"docker_kwargs": {"image": "busybox"}}]})
+    return result
+
+
+def make_flows(flows: int, seed: int = 0):
+    return [Flow(**d) for d in make_flow_dicts(flows, seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=500)
+    parser.add_argument("--instances", type=int, default=5000)
+    args = parser.parse_args()
+
+    study = make_study(args.instances)
+    flows = make_flows(args.flows)
+
+    t0 = time.perf_counter()
+    before = [slice_dataframe_to_triggers(study.copy(), flow.triggers) for flow in flows]
+    t_before = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    engine = TriggerEngine(flows)
+    t_compile = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    after = [sliced for _, sliced in engine.match(study)]
+    t_after = time.perf_counter() - t0
+
+    for b, a in zip(before, after):
+        assert (b is None) == (a is None)
+        if b is not None:
+            pd.testing.assert_frame_equal(b, a)
+
+    matching = sum(a is not None for a in after)
+    print(f"{args.flows} flows x {args.instances} instances, {matching} matching flows")
+    print(f"{'slice_dataframe_to_triggers (before)':>38}: {t_before:8.3f}s")
+    print(f"{'TriggerEngine compile (once)':>38}: {t_compile:8.3f}s")
+    print(f"{'TriggerEngine match (after)':>38}: {t_after:8.3f}s ({t_before / t_after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
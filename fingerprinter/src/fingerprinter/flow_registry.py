@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import yaml
+
+from DicomFlowLib.data_structures.flow import Flow
+
+
+class FlowRegistry:
+    """
+    In-memory registry of the flows in flow_directory. Files are polled for changes (mtime and size) at most every
+    poll_interval seconds, and only changed files are parsed again. A file that cannot be parsed is left out and
+    reported in stats(), without affecting the other flows.
+    """
+    def __init__(self, flow_directory: str, poll_interval: float = 5, log_level: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        self.flow_directory = flow_directory
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+
+        self.entries: Dict[str, Tuple[Tuple[int, int], Flow]] = {}  # path -> (signature, flow)
+        self.errors: Dict[str, Tuple[Tuple[int, int], str]] = {}  # path -> (signature, error)
+        self.flows: List[Flow] = []
+        self.last_refresh = None
+
+        self.refreshes = 0
+        self.files_parsed = 0
+        self.last_refresh_seconds = 0.0
+
+    def list_flow_files(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for fol, subs, filenames in os.walk(self.flow_directory):
+            for file in filenames:
+                if not file.endswith("yaml"):
+                    continue
+                path = os.path.join(fol, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # Removed while walking
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def parse_flow_file(self, path: str, signature: Tuple[int, int]):
+        try:
+            with open(path) as r:
+                flow = Flow(**yaml.safe_load(r))
+            self.entries[path] = (signature, flow)
+            self.errors.pop(path, None)
+            self.logger.info(f"Loaded flow {flow.name} from {path}")
+        except Exception as e:
+            self.entries.pop(path, None)
+            self.errors[path] = (signature, str(e))
+            self.logger.error(f"Could not load flow from {path} - it is skipped until fixed: {e}")
+        self.files_parsed += 1
+
+    def refresh(self):
+        t0 = time.time()
+        with self.lock:
+            files = self.list_flow_files()
+
+            changed = False
+            for path in set(self.entries.keys()).union(self.errors.keys()) - set(files.keys()):
+                self.logger.info(f"Flow file {path} was removed")
+                self.entries.pop(path, None)
+                self.errors.pop(path, None)
+                changed = True
+
+            for path, signature in files.items():
+                known = self.entries.get(path) or self.errors.get(path)
+                if known is None or known[0] != signature:
+                    self.parse_flow_file(path, signature)
+                    changed = True
+
+            if changed:
+                self.flows = [self.entries[path][1] for path in sorted(self.entries.keys())]
+
+            self.last_refresh = time.time()
+            self.last_refresh_seconds = self.last_refresh - t0
+            self.refreshes += 1
+
+        if changed:
+            self.logger.info(f"Flow registry reloaded: {self.stats()}")
+
+    def get_flows(self) -> List[Flow]:
+        if self.last_refresh is None or time.time() - self.last_refresh >= self.poll_interval:
+            self.refresh()
+        return self.flows
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"flows": len(self.entries),
+                    "errors": {path: error for path, (_, error) in self.errors.items()},
+                    "refreshes": self.refreshes,
+                    "files_parsed": self.files_parsed,
+                    "last_refresh": self.last_refresh,
+                    "last_refresh_seconds": round(self.last_refresh_seconds, 4)}
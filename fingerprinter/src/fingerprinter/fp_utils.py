@@ -1,12 +1,63 @@
+import io
 import os
-import tarfile
-from io import BytesIO
-from typing import List, Dict
+import tempfile
+import threading
+from typing import BinaryIO, List, Dict
 
 import pandas as pd
 import yaml
 
 from DicomFlowLib.data_structures.flow import Flow
+from DicomFlowLib.fs.tar_utils import derive_tar
+
+
+class SharedFile:
+    """
+    Lets several threads read one file concurrently. Each view() has its own position, and reads of the
+    underlying file are serialized.
+    """
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.lock = threading.Lock()
+
+    def view(self) -> BinaryIO:
+        return io.BufferedReader(_SharedFileView(self))
+
+    def close(self):
+        self.file.close()
+
+
+class _SharedFileView(io.RawIOBase):
+    def __init__(self, shared: SharedFile):
+        self.shared = shared
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            with self.shared.lock:
+                self.pos = self.shared.file.seek(0, io.SEEK_END) + offset
+        return self.pos
+
+    def readinto(self, b):
+        with self.shared.lock:
+            self.shared.file.seek(self.pos)
+            data = self.shared.file.read(len(b))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
 
 
 def generate_sub_tar_file_path(row: Dict, tar_subdir: List):
@@ -14,21 +65,40 @@ def generate_sub_tar_file_path(row: Dict, tar_subdir: List):
     return os.path.join("/", *prefix, "_".join([row["Modality"], row["SeriesInstanceUID"], row["SOPInstanceUID"] + ".dcm"]))
 
 
-def generate_flow_specific_tar(tar_file: BytesIO, sliced_df: pd.DataFrame, tar_subdir: List):
+def index_rows_by_dcm_path(sliced_df: pd.DataFrame) -> Dict[str, Dict]:
+    """
+    Returns the row of each dcm_path. slice_dataframe_to_triggers returns an instance once per trigger matching it,
+    so identical rows on one path are kept once - before, flows with overlapping triggers failed here. Differing
+    rows on one path mean storescp wrote two instances to one path, and raise.
+    """
+    duplicated = sliced_df[sliced_df["dcm_path"].duplicated(keep=False)]
+    if len(duplicated.drop_duplicates()) != duplicated["dcm_path"].nunique():
+        raise Exception("Unexpected number of rows matched - possible STORESCP overwrite files unintentionally")
+    return {row["dcm_path"]: row for row in sliced_df.drop_duplicates("dcm_path").to_dict("records")}
+
+
+def flow_tar_members(sliced_df: pd.DataFrame, tar_subdir: List) -> Dict[str, str]:
+    """
+    Maps the paths of the sliced instances in the storescp tar to their paths in the flow specific tar.
+    """
+    return {dcm_path: generate_sub_tar_file_path(row, tar_subdir)
+            for dcm_path, row in index_rows_by_dcm_path(sliced_df).items()}
+
+
+def generate_flow_specific_tar(tar_file: BinaryIO,
+                               sliced_df: pd.DataFrame,
+                               tar_subdir: List,
+                               spool_max_size: int = 67108864,
+                               spool_dir: str | None = None):
+    """
+    Copies the members of tar_file matching the rows of sliced_df into a new tar in one sequential pass.
+    The new tar is kept in memory up to spool_max_size bytes and spooled to spool_dir beyond that.
+    """
+    members = flow_tar_members(sliced_df, tar_subdir)
+
     tar_file.seek(0)
-    file = BytesIO()
-    with tarfile.TarFile.open(fileobj=tar_file, mode="r") as storescp_tar:
-        flow_tar = tarfile.TarFile.open(fileobj=file, mode="w")
-        for member in storescp_tar.getmembers():
-            rows = sliced_df[sliced_df["dcm_path"] == member.name]
-            if len(rows) == 1:
-                info = tarfile.TarInfo(generate_sub_tar_file_path(rows.iloc[0], tar_subdir))  # Should not be able to get more than one.)
-                info.size = member.size
-                flow_tar.addfile(info, storescp_tar.extractfile(member.name))
-            elif len(rows) == 0:
-                pass
-            else:
-                raise Exception("Unexpected number of rows matched - possible STORESCP overwrite files unintentionally")
+    file = tempfile.SpooledTemporaryFile(max_size=spool_max_size, dir=spool_dir)
+    derive_tar(src=tar_file, dst=file, members=members)
     file.seek(0)
     return file
 
@@ -1,11 +1,18 @@
-import json
 import logging
-import tarfile
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Iterable
 
+import pandas as pd
+
 from DicomFlowLib.data_structures.contexts import FlowContext, PublishContext, SCPContext
-from DicomFlowLib.fs import FileStorageClient
-from .fp_utils import parse_fingerprints, slice_dataframe_to_triggers, generate_flow_specific_tar
+from DicomFlowLib.data_structures.flow import Flow
+from DicomFlowLib.fs import FileStorageClient, MetadataStore
+from .flow_registry import FlowRegistry
+from .fp_utils import generate_flow_specific_tar, flow_tar_members, SharedFile
+from .result_cache import FingerprintCache, OFF, SUPPRESS
+from .trigger_engine import TriggerEngine
 
 
 class Fingerprinter:
@@ -14,58 +21,150 @@ class Fingerprinter:
                  flow_directory: str,
                  routing_key_success: str,
                  routing_key_fail: str,
+                 flow_registry_poll_interval: float = 5,
+                 tar_spool_dir: str | None = None,
+                 tar_spool_max_size: int = 67108864,
+                 server_side_derive: bool = False,
+                 flow_workers: int = 4,
+                 fingerprint_cache_mode: str = OFF,
+                 fingerprint_cache_ttl: float = 3600,
+                 fingerprint_cache_max_size: int = 10000,
                  log_level: int = 20):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
 
         self.flow_directory = flow_directory
+        self.flow_registry = FlowRegistry(flow_directory=flow_directory,
+                                          poll_interval=flow_registry_poll_interval,
+                                          log_level=log_level)
         self.fs = file_storage
-        self.uid = None
+        self.metadata_store = MetadataStore(file_storage=file_storage, log_level=log_level)  # For claim check
+        self.trigger_engine = None
+        self.trigger_engine_lock = threading.Lock()
+        self.tar_spool_dir = tar_spool_dir
+        if self.tar_spool_dir:
+            os.makedirs(self.tar_spool_dir, exist_ok=True)
+        self.tar_spool_max_size = tar_spool_max_size
+        self.server_side_derive = server_side_derive
+        # Tar generation and upload of matching flows, shared by all messages in flight
+        self.flow_executor = ThreadPoolExecutor(max_workers=flow_workers, thread_name_prefix="flow")
+        self.result_cache = FingerprintCache(mode=fingerprint_cache_mode,
+                                             ttl=fingerprint_cache_ttl,
+                                             max_size=fingerprint_cache_max_size,
+                                             log_level=log_level)
         self.routing_key_success = routing_key_success
         self.routing_key_fail = routing_key_fail
 
-    def mq_entrypoint(self, basic_deliver, body) -> Iterable[PublishContext]:
-        results = []
-        self.logger.info(self.logger.name)
+    def get_trigger_engine(self) -> TriggerEngine:
+        # Recompiled when the flow registry has reloaded
+        flows = self.flow_registry.get_flows()
+        with self.trigger_engine_lock:
+            if self.trigger_engine is None or self.trigger_engine.flows is not flows:
+                self.trigger_engine = TriggerEngine(flows)
+            return self.trigger_engine
 
-        scp_context = SCPContext(**json.loads(body.decode()))
-        self.uid = scp_context.uid
-        tar_file = self.fs.get(scp_context.src_uid)
+    def process_match(self,
+                      scp_context: SCPContext,
+                      flow: Flow,
+                      sliced_dataframe: pd.DataFrame,
+                      tar_file: SharedFile | None,
+                      study_key: str | None = None,
+                      cached_src_uid: str | None = None) -> PublishContext:
         try:
-            for flow in parse_fingerprints(self.flow_directory):
+            return self.fingerprint_flow(scp_context, flow, sliced_dataframe, tar_file, study_key, cached_src_uid)
+        except Exception:
+            if study_key and not cached_src_uid:  # Let copies of the study waiting on this one try themselves
+                self.result_cache.release(study_key, flow)
+            raise
+
+    def fingerprint_flow(self,
+                         scp_context: SCPContext,
+                         flow: Flow,
+                         sliced_dataframe: pd.DataFrame,
+                         tar_file: SharedFile | None,
+                         study_key: str | None,
+                         cached_src_uid: str | None) -> PublishContext:
+        if cached_src_uid:  # Resent study - reuse the flow specific tar produced the first time
+            src_uid = cached_src_uid
+        elif self.server_side_derive:  # Only the member list is sent - the study tar stays on the storage
+            src_uid = self.fs.derive(scp_context.src_uid,
+                                     flow_tar_members(sliced_dataframe, flow.tar_subdir))
+        else:
+            flow_tar_file = generate_flow_specific_tar(sliced_df=sliced_dataframe,
+                                                       tar_file=tar_file.view(),
+                                                       tar_subdir=flow.tar_subdir,
+                                                       spool_max_size=self.tar_spool_max_size,
+                                                       spool_dir=self.tar_spool_dir)
+            try:
+                src_uid = self.fs.post(flow_tar_file)
+            finally:
+                flow_tar_file.close()
+        if study_key and not cached_src_uid:
+            self.result_cache.put(study_key, flow, src_uid)
+        flow_context = FlowContext(flow=flow.model_copy(deep=True),
+                                   src_uid=src_uid,
+                                   dataframe=sliced_dataframe.copy(deep=True),
+                                   sender=scp_context.sender)
+        if scp_context.dataframe_uid:  # Claim check is used upstream - keep the message small
+            flow_context.offload_dataframe(self.metadata_store)
+        self.logger.info(str(flow_context))
+        return PublishContext(routing_key=self.routing_key_success,
+                              body=flow_context.to_body(scp_context.wire_format),
+                              priority=flow.priority)
 
-                sliced_dataframe = slice_dataframe_to_triggers(scp_context.dataframe, flow.triggers)
+    def mq_entrypoint(self, basic_deliver, body) -> Iterable[PublishContext]:
+        # Called concurrently from the consumer threads of MQSub - keep all per-message state local
+        scp_context = SCPContext.from_body(body, metadata_store=self.metadata_store)
+        matches = self.get_trigger_engine().match(scp_context.dataframe)
 
-                if sliced_dataframe is not None:  # If there is a match
-                    self.logger.info(f"MATCHING FLOW")
+        study_key = None
+        cached = {}  # Index in matches -> src_uid of a previous fingerprinting of the study to the flow
+        reserved = set()  # Indices in matches this message fingerprints for the cache
+        submitted = set()
+        tar_file = None
+        results = []
+        futures = []
+        try:
+            if self.result_cache.enabled:
+                study_key = self.result_cache.study_key(scp_context.dataframe)
+                for i, (flow, sliced_dataframe) in enumerate(matches):
+                    if sliced_dataframe is not None:
+                        src_uid = self.result_cache.get(study_key, flow)
+                        if src_uid:
+                            cached[i] = src_uid
+                        else:
+                            reserved.add(i)
 
-                    flow_tar_file = generate_flow_specific_tar(sliced_df=sliced_dataframe,
-                                                               tar_file=tar_file,
-                                                               tar_subdir=flow.tar_subdir)
-                    src_uid = self.fs.post(flow_tar_file)
-                    flow_tar_file.close()
-                    flow_context = FlowContext(flow=flow.copy(deep=True),
-                                               src_uid=src_uid,
-                                               dataframe=sliced_dataframe.copy(deep=True),
-                                               sender=scp_context.sender)
-                    self.logger.info(str(flow_context))
-                    # Publish the context
-                    results.append(
-                        PublishContext(routing_key=self.routing_key_success,
-                                       body=flow_context.model_dump_json().encode(),
-                                       priority=flow.priority)
-                    )
+            if not self.server_side_derive and any(sliced is not None and i not in cached
+                                                   for i, (_, sliced) in enumerate(matches)):
+                tar_file = SharedFile(self.fs.get(scp_context.src_uid))
 
+            for i, (flow, sliced_dataframe) in enumerate(matches):
+                if sliced_dataframe is not None and i in cached and self.result_cache.mode == SUPPRESS:
+                    self.logger.info(f"MATCHING FLOW: {flow.name} - suppressed, study was resent within "
+                                     f"{self.result_cache.ttl}s")
+                elif sliced_dataframe is not None:  # If there is a match
+                    self.logger.info(f"MATCHING FLOW: {flow.name}")
+                    future = self.flow_executor.submit(self.process_match,
+                                                       scp_context, flow, sliced_dataframe, tar_file,
+                                                       study_key, cached.get(i))
+                    submitted.add(i)
+                    futures.append(future)
+                    results.append(future)
                 else:
-                    self.logger.info(f"NOT MATCHING FLOW")
+                    self.logger.info(f"NOT MATCHING FLOW: {flow.name}")
                     results.append(
                         PublishContext(routing_key=self.routing_key_fail,
-                                       body=scp_context.model_dump_json().encode(),
+                                       body=scp_context.to_body(),
                                        priority=flow.priority))
 
+            results = [r.result() if isinstance(r, Future) else r for r in results]
+            if cached:
+                self.logger.info(f"Fingerprint cache: {self.result_cache.stats()}")
             return results
-        except Exception as e:
-            raise e
         finally:
-            tar_file.close()
-            self.uid = None
+            for i in reserved - submitted:  # Failed before fingerprinting - do not leave copies of the study waiting
+                self.result_cache.release(study_key, matches[i][0])
+            wait(futures)  # Workers may still read the tar if one of them failed
+            if tar_file is not None:
+                tar_file.close()
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from typing import Dict, Tuple
+
+import pandas as pd
+
+from DicomFlowLib.data_structures.flow import Flow
+
+OFF = "off"
+SUPPRESS = "suppress"  # A repeated study is not published to the flow again
+REUSE = "reuse"  # A repeated study is published with the flow specific tar produced the first time
+MODES = (OFF, SUPPRESS, REUSE)
+
+
+class FingerprintCache:
+    """
+    Remembers which flows a study has been fingerprinted to, so a resent study can be detected within ttl seconds.
+    Entries are keyed on the set of SOPInstanceUIDs of the study and a hash of the flow definition, so a changed flow
+    or a changed study is a miss. Holds at most max_size entries, least recently used are evicted first.
+
+    A miss reserves the key until put() or release(), so copies of a study arriving together wait for the first one
+    instead of all being fingerprinted.
+    """
+    def __init__(self, mode: str = OFF, ttl: float = 3600, max_size: int = 10000, log_level: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        if mode not in MODES:
+            raise ValueError(f"Fingerprint cache mode must be one of {MODES}, got {mode}")
+        self.mode = mode
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Tuple[str, str], Tuple[float, str]] = OrderedDict()  # key -> (expires, src_uid)
+        self.in_flight: Dict[Tuple[str, str], Future] = {}  # Reserved keys, resolved by put() or release()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    @staticmethod
+    def study_key(dataframe: pd.DataFrame) -> str:
+        uids = sorted(set(dataframe["SOPInstanceUID"].astype(str)))
+        return hashlib.sha256("\n".join(uids).encode()).hexdigest()
+
+    @staticmethod
+    def flow_key(flow: Flow) -> str:
+        return hashlib.sha256(json.dumps(flow.model_dump(mode="json"), sort_keys=True).encode()).hexdigest()
+
+    def get(self, study_key: str, flow: Flow) -> str | None:
+        """
+        Returns the src_uid of the flow specific tar produced for the study, if it was fingerprinted to the flow
+        within ttl. Waits if the study is being fingerprinted to the flow by another caller. On a miss the key is
+        reserved, and the caller must put() or release() it.
+        """
+        key = (study_key, self.flow_key(flow))
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] < time.time():
+                    del self.entries[key]
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+
+                future = self.in_flight.get(key)
+                if future is None:
+                    self.in_flight[key] = Future()
+                    self.misses += 1
+                    return None
+            wait([future])  # Then a hit, or reserved by this caller if the other one released the key
+
+    def put(self, study_key: str, flow: Flow, src_uid: str):
+        key = (study_key, self.flow_key(flow))
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, src_uid)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            future = self.in_flight.pop(key, None)
+        if future is not None:
+            future.set_result(src_uid)
+
+    def release(self, study_key: str, flow: Flow):
+        """
+        Releases the key reserved by a miss without a result, e.g. when fingerprinting failed.
+        """
+        with self.lock:
+            future = self.in_flight.pop((study_key, self.flow_key(flow)), None)
+        if future is not None:
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"mode": self.mode,
+                    "entries": len(self.entries),
+                    "in_flight": len(self.in_flight),
+                    "hits": self.hits,
+                    "misses": self.misses}
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from fingerprinter.flow_registry import FlowRegistry
+
+FLOW = """
+name: {name}
+triggers:
+  - Modality: ["CT"]
+models:
+  - docker_kwargs:
+      image: busybox
+"""
+
+
+class TestFlowRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.flow_directory = self.tmp_dir.name
+        self.registry = FlowRegistry(flow_directory=self.flow_directory, poll_interval=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, file, content):
+        path = os.path.join(self.flow_directory, file)
+        with open(path, "w") as w:
+            w.write(content)
+        return path
+
+    def test_only_changed_files_are_parsed(self):
+        self.write("a.yaml", FLOW.format(name="a"))
+        self.write("b.yaml", FLOW.format(name="b"))
+        self.assertEqual(["a", "b"], [flow.name for flow in self.registry.get_flows()])
+        self.assertEqual(2, self.registry.stats()["files_parsed"])
+
+        self.registry.get_flows()
+        self.assertEqual(2, self.registry.stats()["files_parsed"])
+
+        path = self.write("b.yaml", FLOW.format(name="b2") + "\n")
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(["a", "b2"], [flow.name for flow in self.registry.get_flows()])
+        self.assertEqual(3, self.registry.stats()["files_parsed"])
+
+        os.remove(path)
+        self.assertEqual(["a"], [flow.name for flow in self.registry.get_flows()])
+
+    def test_bad_file_is_isolated(self):
+        self.write("a.yaml", FLOW.format(name="a"))
+        bad = self.write("bad.yaml", "models: [")
+        self.assertEqual(["a"], [flow.name for flow in self.registry.get_flows()])
+        self.assertIn(bad, self.registry.stats()["errors"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import tarfile
+import unittest
+from io import BytesIO
+
+import pandas as pd
+
+from DicomFlowLib.fs.tar_utils import derive_tar
+from fingerprinter.fp_utils import (generate_flow_specific_tar, flow_tar_members, index_rows_by_dcm_path,
+                                    slice_dataframe_to_triggers, SharedFile)
+
+
+class TestFlowSpecificTar(unittest.TestCase):
+    @staticmethod
+    def make_tar(paths):
+        file = BytesIO()
+        with tarfile.open(fileobj=file, mode="w") as tf:
+            for path in paths:
+                info = tarfile.TarInfo(path)
+                info.size = len(path)
+                tf.addfile(info, BytesIO(path.encode()))
+        return file
+
+    def setUp(self):
+        self.df = pd.DataFrame({"dcm_path": ["/CT.1.1.dcm", "/MR.2.2.dcm"],
+                                "Modality": ["CT", "MR"],
+                                "SeriesInstanceUID": ["1", "2"],
+                                "SOPInstanceUID": ["1", "2"]})
+        self.tar_file = self.make_tar(["/CT.1.1.dcm", "/MR.2.2.dcm", "/MR.2.3.dcm"])
+
+    def test_only_sliced_members_are_copied(self):
+        sliced = pd.concat([self.df, self.df.iloc[[0]]])  # Row matched by two triggers
+        with tarfile.open(fileobj=generate_flow_specific_tar(self.tar_file, sliced, ["Modality"])) as tf:
+            members = {m.name: tf.extractfile(m).read() for m in tf.getmembers()}
+        self.assertEqual({"/CT/CT_1_1.dcm": b"/CT.1.1.dcm", "/MR/MR_2_2.dcm": b"/MR.2.2.dcm"}, members)
+
+    def test_server_side_derive_gives_same_members(self):
+        dst = BytesIO()
+        self.tar_file.seek(0)
+        derive_tar(self.tar_file, dst, flow_tar_members(self.df, ["Modality"]))
+        dst.seek(0)
+        with tarfile.open(fileobj=dst) as derived, \
+                tarfile.open(fileobj=generate_flow_specific_tar(self.tar_file, self.df, ["Modality"])) as local:
+            self.assertEqual([m.name for m in local.getmembers()], [m.name for m in derived.getmembers()])
+
+    def test_shared_file_views_read_independently(self):
+        shared = SharedFile(self.tar_file)
+        first, second = shared.view(), shared.view()
+        head = first.read(100)
+        self.assertEqual(head, second.read(100))
+        self.assertEqual(self.tar_file.getvalue()[100:200], first.read(100))
+
+    def test_differing_rows_on_one_path_raise(self):
+        other = self.df.iloc[[0]].assign(Modality="PT")
+        with self.assertRaises(Exception):
+            index_rows_by_dcm_path(pd.concat([self.df, other]))
+        with self.assertRaises(Exception):
+            generate_flow_specific_tar(self.tar_file, pd.concat([self.df, other]), [])
+
+    def test_identical_rows_on_one_path_are_indexed_once(self):
+        # CT matches both triggers, so slice_dataframe_to_triggers returns it twice
+        sliced = slice_dataframe_to_triggers(self.df.copy(), [{"Modality": ["CT|MR"]}, {"Modality": ["CT"]}])
+        self.assertEqual(3, len(sliced))
+        rows = index_rows_by_dcm_path(sliced)
+        self.assertEqual(["/CT.1.1.dcm", "/MR.2.2.dcm"], list(rows))
+        self.assertEqual("CT", rows["/CT.1.1.dcm"]["Modality"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from DicomFlowLib.data_structures.flow import Flow
+import yaml
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from fingerprinter.impl import Fingerprinter
+from fingerprinter.result_cache import FingerprintCache, REUSE, SUPPRESS
+
+
+class SlowFileStorage:
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def post(self, file) -> str:
+        time.sleep(0.2)  # Long enough for the copies of a study to arrive while the first is uploaded
+        uid = str(uuid.uuid4())
+        with self.lock:
+            self.files[uid] = file.read()
+        return uid
+
+    def get(self, uid: str):
+        return BytesIO(self.files[uid])
+
+
+class TestFingerprintCache(unittest.TestCase):
+    def setUp(self):
+        self.flow = Flow(name="flow", triggers=[{"Modality": ["CT"]}],
+                         models=[{"docker_kwargs": {"image": "busybox"}}])
+        self.study_key = FingerprintCache.study_key(pd.DataFrame({"SOPInstanceUID": ["2", "1"]}))
+
+    def test_study_key_is_order_independent(self):
+        self.assertEqual(self.study_key, FingerprintCache.study_key(pd.DataFrame({"SOPInstanceUID": ["1", "2"]})))
+
+    def test_hit_miss_and_expiry(self):
+        cache = FingerprintCache(mode=REUSE, ttl=0.05)
+        self.assertIsNone(cache.get(self.study_key, self.flow))
+        cache.put(self.study_key, self.flow, "src_uid")
+        self.assertEqual("src_uid", cache.get(self.study_key, self.flow))
+
+        changed_flow = self.flow.model_copy(update={"priority": 3})
+        self.assertIsNone(cache.get(self.study_key, changed_flow))
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(self.study_key, self.flow))
+        self.assertEqual({"mode": REUSE, "entries": 0, "in_flight": 2, "hits": 1, "misses": 3}, cache.stats())
+
+    def test_concurrent_miss_waits_for_first(self):
+        cache = FingerprintCache(mode=REUSE)
+        self.assertIsNone(cache.get(self.study_key, self.flow))  # Reserved by this caller
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            waiting = [pool.submit(cache.get, self.study_key, self.flow) for _ in range(2)]
+            time.sleep(0.05)
+            self.assertFalse(any(w.done() for w in waiting))
+            cache.put(self.study_key, self.flow, "src_uid")
+            self.assertEqual(["src_uid", "src_uid"], [w.result(timeout=1) for w in waiting])
+        self.assertEqual({"mode": REUSE, "entries": 1, "in_flight": 0, "hits": 2, "misses": 1}, cache.stats())
+
+    def test_release_lets_a_waiter_reserve(self):
+        cache = FingerprintCache(mode=REUSE)
+        cache.get(self.study_key, self.flow)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(cache.get, self.study_key, self.flow)
+            time.sleep(0.05)
+            cache.release(self.study_key, self.flow)
+            self.assertIsNone(waiting.result(timeout=1))
+        self.assertEqual(1, cache.stats()["in_flight"])
+
+    def test_copies_arriving_together_are_suppressed(self):
+        fs = SlowFileStorage()
+        dataframe = pd.DataFrame({"dcm_path": ["/1.dcm"], "SOPInstanceUID": ["1"], "SeriesInstanceUID": ["1"],
+                                  "Modality": ["CT"]})
+        tar = BytesIO()
+        with tarfile.open(fileobj=tar, mode="w") as tf:
+            info = tarfile.TarInfo("/1.dcm")
+            tf.addfile(info, BytesIO())
+        fs.files["study"] = tar.getvalue()
+        body = SCPContext(src_uid="study", dataframe=dataframe).to_body()
+
+        with tempfile.TemporaryDirectory() as flow_directory:
+            with open(os.path.join(flow_directory, "flow.yaml"), "w") as w:
+                yaml.safe_dump({"triggers": [{"Modality": ["CT"]}], "models": [{"docker_kwargs": {"image": "a"}}]}, w)
+            fp = Fingerprinter(file_storage=fs, flow_directory=flow_directory, routing_key_success="success",
+                               routing_key_fail="fail", fingerprint_cache_mode=SUPPRESS)
+            with ThreadPoolExecutor(max_workers=3) as consumers:  # As MQSub with a prefetch count of 3
+                results = list(consumers.map(lambda b: fp.mq_entrypoint(None, b), [body] * 3))
+            fp.flow_executor.shutdown()
+
+        self.assertEqual(1, sum(len(r) for r in results))  # Published once, the copies are suppressed
+        self.assertEqual(2, len(fs.files))  # The study and one flow specific tar
+        self.assertEqual(2, fp.result_cache.hits)
+
+    def test_max_size(self):
+        cache = FingerprintCache(mode=REUSE, max_size=1)
+        cache.put(self.study_key, self.flow, "first")
+        cache.put("other", self.flow, "second")
+        self.assertIsNone(cache.get(self.study_key, self.flow))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import pandas as pd
+
+from DicomFlowLib.data_structures.flow import Flow
+from fingerprinter.fp_utils import slice_dataframe_to_triggers
+from fingerprinter.trigger_engine import TriggerEngine
+
+
+class TestTriggerEngine(unittest.TestCase):
+    def test_same_result_as_slice_dataframe_to_triggers(self):
+        df = pd.DataFrame({"dcm_path": ["/1.dcm", "/2.dcm", "/3.dcm"],
+                           "Modality": ["CT", "MR", "RTSTRUCT"],
+                           "SeriesDescription": ["Thorax", "T2 tra", None]})
+        flows = [Flow(triggers=triggers, models=[{"docker_kwargs": {"image": "busybox"}}]) for triggers in [
+            [{"Modality": ["CT"]}, {"Modality": ["MR"], "SeriesDescription": ["tra$"]}],
+            [{"Modality": ["~CT", "~MR"]}],
+            [{"SeriesDescription": ["~Thorax"]}],
+            [{"Modality": ["PT"]}],
+            [{"BodyPartExamined": ["CHEST"]}],
+        ]]
+
+        for flow, sliced in TriggerEngine(flows).match(df):
+            expected = slice_dataframe_to_triggers(df.copy(), flow.triggers)
+            if expected is None:
+                self.assertIsNone(sliced)
+            else:
+                pd.testing.assert_frame_equal(expected, sliced)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import re
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from DicomFlowLib.data_structures.flow import Flow
+
+# (keyword, compiled pattern, negated) for each pattern of a trigger
+CompiledTrigger = List[Tuple[str, re.Pattern, bool]]
+
+
+class TriggerEngine:
+    """
+    Matches studies against the triggers of many flows. Patterns are compiled once. Instances are grouped on the
+    values of the trigger keywords (typically one group per series), and triggers are evaluated on the groups
+    only. Each distinct (keyword, pattern) is evaluated once per study and shared by all flows using it.
+    Matching gives the same result as slice_dataframe_to_triggers for every flow.
+    """
+    def __init__(self, flows: List[Flow]):
+        self.flows = flows
+        patterns: Dict[str, re.Pattern] = {}
+
+        self.compiled: List[List[CompiledTrigger]] = []
+        self.keyword_index: Dict[str, Set[int]] = {}  # keyword -> flows referencing it
+        for i, flow in enumerate(flows):
+            compiled_triggers = []
+            for trigger in flow.triggers:
+                compiled_trigger = []
+                for keyword, regex_patterns in trigger.items():
+                    self.keyword_index.setdefault(keyword, set()).add(i)
+                    for regex_pattern in regex_patterns:
+                        negated = regex_pattern.startswith("~")
+                        pattern = regex_pattern[1:] if negated else regex_pattern
+                        if pattern not in patterns:
+                            patterns[pattern] = re.compile(pattern)
+                        compiled_trigger.append((keyword, patterns[pattern], negated))
+                compiled_triggers.append(compiled_trigger)
+            self.compiled.append(compiled_triggers)
+
+    @staticmethod
+    def evaluate(column: pd.Series, pattern: re.Pattern) -> np.ndarray:
+        # The regex only runs on the distinct values of the column. Missing values never match
+        codes, uniques = pd.factorize(column)
+        unique_mask = np.fromiter((pattern.search(value) is not None for value in uniques),
+                                  dtype=bool, count=len(uniques))
+        return np.where(codes >= 0, unique_mask[codes], False)
+
+    def match(self, dataframe: pd.DataFrame) -> List[Tuple[Flow, pd.DataFrame | None]]:
+        """
+        Returns each flow with the rows matching its triggers, or None if the flow does not match. The returned
+        DataFrames may be shared between flows, so copy them before modifying.
+        """
+        dataframe = dataframe.astype(str)
+        missing_keywords = set(self.keyword_index.keys()) - set(dataframe.columns)
+        skipped = set().union(*(self.keyword_index[keyword] for keyword in missing_keywords))
+
+        # Triggers are evaluated on the unique combinations of the trigger keywords, and expanded to the instances
+        keywords = sorted(set(self.keyword_index.keys()) - missing_keywords)
+        if keywords:
+            group_codes, groups = pd.MultiIndex.from_frame(dataframe[keywords]).factorize()
+            groups = groups.to_frame(index=False, name=keywords)  # factorize drops the level names
+        else:
+            group_codes, groups = np.zeros(len(dataframe), dtype=np.intp), pd.DataFrame(index=range(1))
+
+        masks: Dict[Tuple[str, re.Pattern], np.ndarray] = {}  # Masks over groups
+        slices: Dict[bytes, pd.DataFrame | None] = {}  # Instances of a group mask, shared by identical triggers
+        results = []
+        for i, flow in enumerate(self.flows):
+            if i in skipped:  # References a keyword the study does not have
+                results.append((flow, None))
+                continue
+
+            matches = []
+            for compiled_trigger in self.compiled[i]:
+                trigger_mask = np.ones(len(groups), dtype=bool)
+                for keyword, pattern, negated in compiled_trigger:
+                    if (keyword, pattern) not in masks:
+                        masks[(keyword, pattern)] = self.evaluate(groups[keyword], pattern)
+                    mask = masks[(keyword, pattern)]
+                    trigger_mask &= ~mask if negated else mask
+
+                key = trigger_mask.tobytes()
+                if key not in slices:
+                    instance_mask = trigger_mask[group_codes]
+                    slices[key] = dataframe[instance_mask] if instance_mask.any() else None
+                if slices[key] is None:
+                    matches = None
+                    break
+                matches.append(slices[key])
+
+            results.append((flow, pd.concat(matches) if matches is not None else None))
+        return results
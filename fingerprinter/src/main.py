@@ -33,6 +33,14 @@ class Main:
                                 flow_directory=config["FLOW_DIRECTORY"],
                                 routing_key_success=config["PUB_ROUTING_KEY_SUCCESS"],
                                 routing_key_fail=config["PUB_ROUTING_KEY_FAIL"],
+                                flow_registry_poll_interval=float(config["FLOW_REGISTRY_POLL_INTERVAL"]),
+                                tar_spool_dir=config["TAR_SPOOL_DIR"],
+                                tar_spool_max_size=int(config["TAR_SPOOL_MAX_SIZE"]),
+                                server_side_derive=str(config["SERVER_SIDE_DERIVE"]).lower() == "true",
+                                flow_workers=int(config["FLOW_WORKERS"]),
+                                fingerprint_cache_mode=config["FINGERPRINT_CACHE_MODE"],
+                                fingerprint_cache_ttl=float(config["FINGERPRINT_CACHE_TTL"]),
+                                fingerprint_cache_max_size=int(config["FINGERPRINT_CACHE_MAX_SIZE"]),
                                 log_level=int(config["LOG_LEVEL"]))
 
         self.mq = MQSub(work_function=self.fp.mq_entrypoint,
@@ -59,6 +67,7 @@ class Main:
 
     def stop(self, signalnum=None, stack_frame=None):
         self.running = False
+        self.fp.flow_executor.shutdown(wait=True)  # Finish tar generation and uploads of flows in progress
         self.mq.stop()
         self.mq.join()
 
@@ -5,6 +5,7 @@ from typing import Iterable, Dict, List
 import pandas as pd
 
 from DicomFlowLib.data_structures.contexts import FlowContext, PublishContext
+from DicomFlowLib.fs import FileStorageClient, MetadataStore
 from .db import Database
 
 
@@ -12,9 +13,13 @@ class FlowTracker:
     def __init__(self,
                  database_path: str,
                  dashboard_rules: List[Dict],
+                 file_storage: FileStorageClient | None = None,
                  log_level: int = 20):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
+        self.metadata_store = None
+        if file_storage is not None:  # Needed to read dataframes offloaded with claim check
+            self.metadata_store = MetadataStore(file_storage=file_storage, log_level=log_level)
         self.engine = None
         self.database_url = None
         self.dashboard_rules = dashboard_rules
@@ -27,7 +32,7 @@ class FlowTracker:
             self.db.insert_log_row(json.loads(body.decode()))
             return []
         else:
-            context = FlowContext(**json.loads(body.decode()))
+            context = FlowContext.from_body(body, validate_flow=False, metadata_store=self.metadata_store)
             self.update_dashboard_rows(basic_deliver, context)
             return []
 
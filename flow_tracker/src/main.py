@@ -3,6 +3,7 @@ import os
 import signal
 
 from DicomFlowLib.conf import load_configs
+from DicomFlowLib.fs import FileStorageClient
 from DicomFlowLib.log import init_logger
 from DicomFlowLib.mq import SubModel, PubModel
 from DicomFlowLib.mq import MQSub
@@ -24,8 +25,14 @@ class Main:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(int(config["LOG_LEVEL"]))
 
+        self.fs = None
+        if config["FILE_STORAGE_URL"]:
+            self.fs = FileStorageClient(file_storage_url=config["FILE_STORAGE_URL"],
+                                        log_level=int(config["LOG_LEVEL"]))
+
         self.ft = FlowTracker(database_path=config["DATABASE_PATH"],
                               dashboard_rules=config["DASHBOARD_RULES"],
+                              file_storage=self.fs,
                               log_level=int(config["LOG_LEVEL"]))
 
         self.mq = MQSub(rabbit_hostname=config["RABBIT_HOSTNAME"], rabbit_port=int(config["RABBIT_PORT"]),
@@ -7,6 +7,7 @@ from DicomFlowLib.log import init_logger
 from DicomFlowLib.mq import MQSub
 from DicomFlowLib.mq import PubModel, SubModel
 from scheduler.impl import Scheduler
+from scheduler.state_store import StateStore, SQLiteStateStore
 
 
 class Main:
@@ -24,20 +25,43 @@ class Main:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(int(config["LOG_LEVEL"]))
 
+        sub_queue_kwargs = config["SUB_QUEUE_KWARGS"]
+        if config["STATE_DB_PATH"]:
+            self.state_store = SQLiteStateStore(db_path=config["STATE_DB_PATH"],
+                                                ttl=float(config["STATE_TTL"]),
+                                                max_flows=int(config["STATE_MAX_FLOWS"]),
+                                                log_level=int(config["LOG_LEVEL"]))
+            # The state only helps if unacked messages and completions sent while down survive a restart
+            sub_queue_kwargs = {**sub_queue_kwargs,
+                                "queue": config["STATE_SUB_QUEUE"],
+                                "durable": True,
+                                "exclusive": False,
+                                "auto_delete": False}
+        else:
+            self.state_store = StateStore(ttl=float(config["STATE_TTL"]),
+                                          max_flows=int(config["STATE_MAX_FLOWS"]),
+                                          log_level=int(config["LOG_LEVEL"]))
+
         self.scheduler = Scheduler(pub_routing_key_success=config["PUB_ROUTING_KEY_SUCCESS"],
                                    pub_routing_key_fail=config["PUB_ROUTING_KEY_FAIL"],
                                    pub_routing_key_gpu=config["PUB_ROUTING_KEY_GPU"],
                                    pub_routing_key_cpu=config["PUB_ROUTING_KEY_CPU"],
                                    log_level=int(config["LOG_LEVEL"]),
                                    consumer_exchange=config["SUB_CONSUMER_EXCHANGE"],
-                                   reschedule_priority=config["SUB_RESCHEDULE_PRIORITY"])
+                                   reschedule_priority=int(config["SUB_RESCHEDULE_PRIORITY"]),
+                                   state_store=self.state_store,
+                                   critical_path_priority=str(config["PRIORITY_CRITICAL_PATH"]).lower() == "true",
+                                   runtime_alpha=float(config["PRIORITY_RUNTIME_ALPHA"]),
+                                   default_runtime=float(config["PRIORITY_DEFAULT_RUNTIME"]),
+                                   critical_path_horizon=float(config["PRIORITY_CRITICAL_PATH_HORIZON"]),
+                                   max_priority=int(config["PRIORITY_MAX"]))
 
         self.mq = MQSub(rabbit_hostname=config["RABBIT_HOSTNAME"], rabbit_port=int(config["RABBIT_PORT"]),
                         sub_models=[SubModel(**d) for d in config["SUB_MODELS"]],
                         pub_models=[PubModel(**d) for d in config["PUB_MODELS"]],
                         work_function=self.scheduler.mq_entrypoint,
                         sub_prefetch_value=int(config["SUB_PREFETCH_COUNT"]),
-                        sub_queue_kwargs=config["SUB_QUEUE_KWARGS"],
+                        sub_queue_kwargs=sub_queue_kwargs,
                         pub_routing_key_error=config["PUB_ROUTING_KEY_ERROR"],
                         log_level=int(config["LOG_LEVEL"]))
 
@@ -59,6 +83,7 @@ class Main:
         self.running = False
         self.mq.stop()
         self.mq.join()
+        self.state_store.close()
 
 
 if __name__ == "__main__":
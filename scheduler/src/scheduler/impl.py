@@ -1,10 +1,12 @@
-import json
 import logging
-from typing import Iterable, Dict, Tuple, List
+from typing import Iterable, Tuple
 
 import pika.spec
 
 from DicomFlowLib.data_structures.contexts import FlowContext, PublishContext
+from .priority import RuntimeHistory, remaining_critical_path
+from .readiness import FlowReadiness
+from .state_store import StateStore
 
 
 class Scheduler:
@@ -15,6 +17,12 @@ class Scheduler:
                  pub_routing_key_cpu: str,
                  reschedule_priority: int,
                  consumer_exchange: str,
+                 state_store: StateStore | None = None,
+                 critical_path_priority: bool = True,
+                 runtime_alpha: float = 0.3,
+                 default_runtime: float = 300,
+                 critical_path_horizon: float = 3600,
+                 max_priority: int = 5,
                  log_level: int = 20):
         self.pub_declared = False
         self.logger = logging.getLogger(__name__)
@@ -27,48 +35,67 @@ class Scheduler:
         self.pub_routing_key_cpu = pub_routing_key_cpu
         self.pub_routing_key_success = pub_routing_key_success
         self.pub_routing_key_fail = pub_routing_key_fail
-        self.mount_mapping: Dict[str, Dict[str, str]] = {}
-        self.dispatched_flows: Dict[str, List[int]] = {}
+        # Mount mappings and dispatched models of the flows in flight
+        self.state_store = state_store if state_store is not None else StateStore(log_level=log_level)
+
+        # Rescheduled models get at least reschedule_priority, raised towards max_priority (x-max-priority of the
+        # queues) by the length of the critical path remaining from them, weighted by the runtime history of the
+        # models. Remaining paths of critical_path_horizon seconds or more get max_priority. Models ready at the same
+        # time are published longest remaining path first, so ties are broken by the critical path as well
+        self.critical_path_priority = critical_path_priority
+        self.critical_path_horizon = critical_path_horizon
+        self.max_priority = max_priority
+        self.runtime_history = RuntimeHistory(alpha=runtime_alpha, default_runtime=default_runtime)
 
     def mq_entrypoint(self, basic_deliver, body) -> Iterable[PublishContext]:
-        fc = FlowContext(**json.loads(body.decode()))
-
-        priority = self.determine_priority(fc, basic_deliver)
-        self.logger.debug(f"Setting priority from {fc.flow.priority} to {priority}")
+        fc = FlowContext.from_body(body, validate_flow=False)  # Validated by the fingerprinter
+        self.record_runtime(fc)
 
         for new_fc, routing_key in self.schedule_from_flow_context(fc):
-            yield PublishContext(body=new_fc.model_dump_json().encode(),
+            priority = self.determine_priority(new_fc, basic_deliver)
+            self.logger.debug(f"Setting priority from {fc.flow.priority} to {priority}")
+            yield PublishContext(body=new_fc.to_body(),
                                  routing_key=routing_key,
                                  priority=priority)
 
     def determine_priority(self, flow_context: FlowContext, basic_deliver: pika.spec.Basic.Deliver):
         if basic_deliver.exchange == self.consumer_exchange and basic_deliver.routing_key:
-            return self.reschedule_priority
+            if not self.critical_path_priority or flow_context.active_model_idx is None:
+                return self.reschedule_priority
+            remaining = remaining_critical_path(flow_context.flow, self.runtime_history)[flow_context.active_model_idx]
+            weight = min(remaining / self.critical_path_horizon, 1.0)
+            return self.reschedule_priority + round(max(self.max_priority - self.reschedule_priority, 0) * weight)
         else:
             return flow_context.flow.priority
 
+    def record_runtime(self, fc: FlowContext):
+        # Run time reported by the consumer, so time spent queued does not count
+        if fc.active_model_idx is not None and fc.active_model_runtime is not None:
+            self.runtime_history.add(fc.active_model, fc.active_model_runtime)
+
     def schedule_from_flow_context(self, fc: FlowContext) -> Iterable[Tuple[FlowContext, str]]:
         fc = self.update_mount_mapping(fc)
         if self.check_flow_finished(fc):
             yield fc, self.pub_routing_key_success
-            del self.mount_mapping[fc.uid]
+            self.state_store.delete(fc.uid)
         else:
             for new_fc in self.yield_eligible_models_as_publish_contexts(fc):
                 if new_fc.active_model.gpu:
                     yield new_fc, self.pub_routing_key_gpu
                 else:
                     yield new_fc, self.pub_routing_key_cpu
+            # Saved when everything is published. After a crash before that, the unacked message is redelivered from
+            # the durable queue used with a SQLiteStateStore (STATE_SUB_QUEUE) and dispatched again
+            self.state_store.save(fc.uid, self.state_store.get_or_create(fc.uid))
 
     def update_mount_mapping(self, fc: FlowContext):
-        if fc.uid not in self.mount_mapping.keys():
-            self.mount_mapping[fc.uid] = {}
-
-        self.mount_mapping[fc.uid] = {**self.mount_mapping[fc.uid], **fc.mount_mapping}
-        fc.mount_mapping = self.mount_mapping[fc.uid]
+        state = self.state_store.get_or_create(fc.uid)
+        state.mount_mapping.update(fc.mount_mapping)
+        fc.mount_mapping = state.mount_mapping
         return fc
 
     def get_mapping_by_uid(self, flow_context_uid: str):
-        return self.mount_mapping[flow_context_uid]
+        return self.state_store.get(flow_context_uid).mount_mapping
 
     def get_mapping_keys_by_uid(self, flow_context_uid: str):
         return set(self.get_mapping_by_uid(flow_context_uid).keys())
@@ -77,24 +104,32 @@ class Scheduler:
     def check_flow_finished(fc: FlowContext):
         return "dst" in fc.mount_mapping.keys()
 
+    def get_readiness(self, fc: FlowContext) -> FlowReadiness:
+        state = self.state_store.get_or_create(fc.uid)
+        if state.readiness is None:  # Also rebuilt for flows resumed from a durable store
+            state.readiness = FlowReadiness(fc.flow.dag)
+        return state.readiness
+
     def yield_eligible_models_as_publish_contexts(self, fc: FlowContext) -> Iterable[FlowContext]:
         uid = fc.uid
-        for i, model in enumerate(fc.flow.models):
+        mapping_keys = self.get_mapping_by_uid(uid).keys()
+        # Only models whose last missing input has just landed are considered
+        ready = self.get_readiness(fc).update(mapping_keys)
+        if self.critical_path_priority and len(ready) > 1:
+            remaining = remaining_critical_path(fc.flow, self.runtime_history)
+            ready = sorted(ready, key=lambda i: remaining[i], reverse=True)
+        for i in ready:
 
             # Checks if this task has already been dispatched
             if self.is_already_scheduled(i, uid):
                 continue
 
-            if model.input_mount_keys.issubset(self.get_mapping_keys_by_uid(uid)):
-                if not model.output_mount_keys.issubset(self.get_mapping_keys_by_uid(uid)):
-                    new_fc: FlowContext = fc.model_copy(deep=True)
-                    new_fc.active_model_idx = i
-                    self.dispatched_flows[uid].append(i)
-                    yield new_fc
+            if not fc.flow.models[i].output_mount_keys.issubset(mapping_keys):
+                new_fc: FlowContext = fc.model_copy(deep=True)
+                new_fc.active_model_idx = i
+                new_fc.active_model_runtime = None
+                self.state_store.get(uid).dispatched.append(i)
+                yield new_fc
 
     def is_already_scheduled(self, i, uid):
-        if uid not in self.dispatched_flows.keys():
-            self.dispatched_flows[uid] = []
-            return False
-
-        return i in self.dispatched_flows[uid]
+        return i in self.state_store.get_or_create(uid).dispatched
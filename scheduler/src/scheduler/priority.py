@@ -0,0 +1,48 @@
+import hashlib
+import json
+import threading
+from typing import Dict, List
+
+from DicomFlowLib.data_structures.flow import Flow
+from DicomFlowLib.data_structures.flow.model import Model
+
+
+class RuntimeHistory:
+    """
+    Exponentially weighted moving average of the runtimes of models, as reported by the consumers. Models are
+    identified by their docker kwargs, so the same model in different flows shares its history.
+    """
+    def __init__(self, alpha: float = 0.3, default_runtime: float = 300):
+        self.alpha = alpha
+        self.default_runtime = default_runtime  # Used for models without history
+        self.lock = threading.Lock()
+        self.runtimes: Dict[str, float] = {}
+
+    @staticmethod
+    def model_key(model: Model) -> str:
+        return hashlib.sha256(json.dumps([model.docker_kwargs, model.gpu], sort_keys=True, default=str).encode()
+                              ).hexdigest()
+
+    def add(self, model: Model, runtime: float):
+        key = self.model_key(model)
+        with self.lock:
+            previous = self.runtimes.get(key)
+            self.runtimes[key] = runtime if previous is None else self.alpha * runtime + (1 - self.alpha) * previous
+
+    def get(self, model: Model) -> float:
+        with self.lock:
+            return self.runtimes.get(self.model_key(model), self.default_runtime)
+
+
+def remaining_critical_path(flow: Flow, history: RuntimeHistory) -> List[float]:
+    """
+    Returns for each model of the flow the length in seconds of the longest path from the start of the model to the
+    end of the flow (upward rank). Models with more work behind them should run first to shorten the flow.
+    """
+    dag = flow.dag
+    runtimes = [history.get(model) for model in flow.models]
+
+    remaining = [0.0] * len(runtimes)
+    for i in reversed(dag.topological_order):
+        remaining[i] = runtimes[i] + max((remaining[u] for u in dag.adjacency[i]), default=0.0)
+    return remaining
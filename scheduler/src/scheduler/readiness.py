@@ -0,0 +1,28 @@
+from typing import Iterable, List
+
+from DicomFlowLib.data_structures.flow import FlowDAG
+
+
+class FlowReadiness:
+    """
+    Tracks which models of a flow have all their inputs in the mount mapping. Each model counts its missing inputs,
+    and only the consumers of newly landed mounts are touched, so an update does not scan the whole flow.
+    """
+    def __init__(self, dag: FlowDAG):
+        self.dag = dag
+        self.landed = set()
+        self.missing_inputs = [len(inputs) for inputs in dag.inputs]
+        self.ready = [i for i, missing in enumerate(self.missing_inputs) if missing == 0]  # Not returned yet
+
+    def update(self, mount_keys: Iterable[str]) -> List[int]:
+        """
+        Registers the landed mounts and returns the models that have become ready since the last update.
+        """
+        ready, self.ready = self.ready, []
+        for mount in set(mount_keys) - self.landed:
+            self.landed.add(mount)
+            for i in self.dag.consumers.get(mount, []):
+                self.missing_inputs[i] -= 1
+                if self.missing_inputs[i] == 0:
+                    ready.append(i)
+        return sorted(ready)
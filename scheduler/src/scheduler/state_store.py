@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from .readiness import FlowReadiness
+
+
+class FlowState:
+    """
+    Scheduling state of one flow in flight. The readiness is derived from the flow and mount mapping, so it is
+    not persisted.
+    """
+    def __init__(self, mount_mapping: Dict[str, str] | None = None, dispatched: List[int] | None = None):
+        self.mount_mapping: Dict[str, str] = mount_mapping or {}
+        self.dispatched: List[int] = dispatched or []
+        self.readiness: FlowReadiness | None = None
+        self.last_update = time.time()
+
+
+class StateStore:
+    """
+    In-memory store of the FlowStates of the scheduler. Flows not updated for ttl seconds are evicted (e.g. failed
+    flows that never finish), and at most max_flows are kept, least recently updated are evicted first.
+    """
+    def __init__(self, ttl: float = 604800, max_flows: int = 10000, log_level: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        self.ttl = ttl
+        self.max_flows = max_flows
+        self.lock = threading.RLock()
+        self.states: OrderedDict[str, FlowState] = OrderedDict()  # Least recently updated first
+        self.evictions = 0
+
+    def __contains__(self, uid: str):
+        return self.get(uid) is not None
+
+    def __len__(self):
+        return len(self.states)
+
+    def get(self, uid: str) -> FlowState | None:
+        with self.lock:
+            return self.states.get(uid)
+
+    def get_or_create(self, uid: str) -> FlowState:
+        with self.lock:
+            state = self.get(uid)
+            if state is None:
+                state = FlowState()
+                self.states[uid] = state
+                self.evict()
+            return state
+
+    def save(self, uid: str, state: FlowState):
+        with self.lock:
+            state.last_update = time.time()
+            self.states[uid] = state
+            self.states.move_to_end(uid)
+            self.evict()
+
+    def delete(self, uid: str):
+        with self.lock:
+            self.states.pop(uid, None)
+
+    def close(self):
+        pass
+
+    def evict(self):
+        expired = time.time() - self.ttl
+        while self.states:
+            uid, state = next(iter(self.states.items()))
+            if state.last_update >= expired:
+                break
+            self.logger.warning(f"Evicting flow {uid} - not updated for {self.ttl} seconds")
+            self.delete(uid)
+            self.evictions += 1
+        while len(self.states) > self.max_flows:
+            uid, _ = self.states.popitem(last=False)
+            self.logger.warning(f"Evicting flow {uid} - more than {self.max_flows} flows in flight")
+            self.evictions += 1
+
+
+class SQLiteStateStore(StateStore):
+    """
+    StateStore writing through to a SQLite database, so a restarted scheduler resumes the flows in flight. Flows
+    evicted from memory by max_flows are still loaded from the database when they are updated again. Expired flows
+    are removed from the database every purge_interval seconds.
+
+    Resuming needs the messages sent while the scheduler was down, so it must consume from a durable queue that
+    outlives it - see STATE_SUB_QUEUE in the scheduler config.
+    """
+    def __init__(self, db_path: str, ttl: float = 604800, max_flows: int = 10000, purge_interval: float = 3600,
+                 log_level: int = 20):
+        super().__init__(ttl=ttl, max_flows=max_flows, log_level=log_level)
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS flow_state "
+                        "(uid TEXT PRIMARY KEY, mount_mapping TEXT, dispatched TEXT, last_update REAL)")
+        self.purge_interval = purge_interval
+        self.last_purge = 0
+        self.purge()
+
+    def get(self, uid: str) -> FlowState | None:
+        with self.lock:
+            state = super().get(uid)
+            if state is None:
+                row = self.db.execute("SELECT mount_mapping, dispatched, last_update FROM flow_state WHERE uid = ?",
+                                      (uid,)).fetchone()
+                if row is not None and row[2] >= time.time() - self.ttl:
+                    self.logger.info(f"Resuming flow {uid} from {self.db_path}")
+                    state = FlowState(mount_mapping=json.loads(row[0]), dispatched=json.loads(row[1]))
+                    state.last_update = row[2]
+                    self.states[uid] = state
+                    # Keep the states ordered by last_update, so evict only has to look at the head
+                    for newer in [u for u, s in self.states.items() if s.last_update > state.last_update]:
+                        self.states.move_to_end(newer)
+                    self.evict()
+            return state
+
+    def save(self, uid: str, state: FlowState):
+        with self.lock:
+            super().save(uid, state)
+            self.db.execute("INSERT OR REPLACE INTO flow_state VALUES (?, ?, ?, ?)",
+                            (uid, json.dumps(state.mount_mapping), json.dumps(state.dispatched), state.last_update))
+            if time.time() - self.last_purge > self.purge_interval:
+                self.purge()
+
+    def delete(self, uid: str):
+        with self.lock:
+            super().delete(uid)
+            self.db.execute("DELETE FROM flow_state WHERE uid = ?", (uid,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def purge(self):
+        with self.lock:
+            purged = self.db.execute("DELETE FROM flow_state WHERE last_update < ?",
+                                     (time.time() - self.ttl,)).rowcount
+            if purged:
+                self.logger.warning(f"Purged {purged} flows not updated for {self.ttl} seconds")
+            self.last_purge = time.time()
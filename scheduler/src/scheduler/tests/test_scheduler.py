@@ -1,10 +1,15 @@
 import logging
+import os
 import queue
+import tempfile
+import time
 import unittest
 import uuid
+from types import SimpleNamespace
 
 import yaml
 from scheduler import Scheduler
+from scheduler.state_store import FlowState, StateStore, SQLiteStateStore
 
 from DicomFlowLib.data_structures.contexts import FlowContext
 from DicomFlowLib.data_structures.flow import Flow, Destination
@@ -32,7 +37,7 @@ class MyTestCase(unittest.TestCase):
 
     def test_update_mount_mapping(self):
         self.scheduler.update_mount_mapping(self.fc)
-        self.assertIn(self.fc.uid, self.scheduler.mount_mapping)
+        self.assertIn(self.fc.uid, self.scheduler.state_store)
 
     def test_yield_eligible_models_as_publish_contexts(self):
         self.scheduler.update_mount_mapping(self.fc)
@@ -73,6 +78,118 @@ class MyTestCase(unittest.TestCase):
                 if routing_key != "success":
                     q.put(new_fc)
 
+    def test_fan_out_models_are_yielded_once_when_ready(self):
+        folds = 20
+        models = [{"docker_kwargs": {"image": "busybox"}, "output_mounts": {f"fold_{i}": "/output"}}
+                  for i in range(folds)]
+        models.append({"docker_kwargs": {"image": "busybox"},
+                       "input_mounts": {f"fold_{i}": f"/fold_{i}" for i in range(folds)}})
+        fc = FlowContext(src_uid="src", flow=Flow(models=models))
+
+        fold_fcs = [new_fc for new_fc, _ in self.scheduler.schedule_from_flow_context(fc)]
+        self.assertEqual(list(range(folds)), [f.active_model_idx for f in fold_fcs])
+
+        for fold_fc in fold_fcs:
+            new_fcs = list(self.scheduler.schedule_from_flow_context(self.mock_model_run(fold_fc)))
+            if fold_fc is not fold_fcs[-1]:
+                self.assertEqual([], new_fcs)
+        self.assertEqual([folds], [f.active_model_idx for f, _ in new_fcs])
+
+    def test_flows_are_resumed_from_sqlite_state_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "scheduler.db")
+            self.scheduler.state_store = SQLiteStateStore(db_path=db_path)
+            first_model = [fc for fc, _ in self.scheduler.schedule_from_flow_context(self.fc)]
+            self.scheduler.state_store.close()
+
+            # Restart while the first model runs
+            self.scheduler.state_store = SQLiteStateStore(db_path=db_path)
+            try:
+                self.assertEqual([0], self.scheduler.state_store.get(self.fc.uid).dispatched)
+                resumed = [fc.active_model_idx for fc, _ in
+                           self.scheduler.schedule_from_flow_context(self.mock_model_run(first_model[0]))]
+                self.assertEqual([1, 2], resumed)
+            finally:
+                self.scheduler.state_store.close()
+
+    def test_stale_flows_are_evicted(self):
+        self.scheduler.state_store = StateStore(ttl=0.05, max_flows=1)
+        list(self.scheduler.schedule_from_flow_context(self.fc))
+        time.sleep(0.1)
+        other = self.fc.model_copy(update={"uid": "other"}, deep=True)
+        list(self.scheduler.schedule_from_flow_context(other))
+        self.assertNotIn(self.fc.uid, self.scheduler.state_store)
+        self.assertEqual(1, len(self.scheduler.state_store))
+
+    def test_resumed_stale_flows_are_evicted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteStateStore(db_path=os.path.join(tmp, "scheduler.db"), ttl=0.5)
+            try:
+                store.save("stale", FlowState())
+                store.states.clear()  # As after a restart
+                time.sleep(0.3)
+                store.save("fresh", FlowState())
+
+                # Resumed behind the fresh flow, but still the least recently updated
+                self.assertIn("stale", store)
+                self.assertEqual(["stale", "fresh"], list(store.states))
+
+                time.sleep(0.3)
+                store.save("other", FlowState())
+                self.assertNotIn("stale", store)
+                self.assertEqual(["fresh", "other"], list(store.states))
+            finally:
+                store.close()
+
+    def test_critical_path_priority(self):
+        scheduler = Scheduler(pub_routing_key_success="success", pub_routing_key_fail="fail",
+                              pub_routing_key_gpu="gpu", pub_routing_key_cpu="cpu", consumer_exchange="consumer",
+                              reschedule_priority=2, max_priority=5)
+        consumer = SimpleNamespace(exchange="consumer", routing_key="success")
+        chain = [{"docker_kwargs": {"image": f"model_{i}"},
+                  "input_mounts": {f"m{i}" if i else "src": "/input"},
+                  "output_mounts": {f"m{i + 1}" if i < 5 else "dst": "/output"}} for i in range(6)]
+        fc = FlowContext(src_uid="src", flow=Flow(models=chain, priority=1))
+        fc.active_model_idx = 0
+        self.assertEqual(1, scheduler.determine_priority(fc, SimpleNamespace(exchange="fingerprinter",
+                                                                             routing_key="success")))
+        scheduler.runtime_history.add(fc.flow.models[0], 3000)
+        for i in range(1, 6):
+            scheduler.runtime_history.add(fc.flow.models[i], 600)
+        priorities = []
+        for i in range(1, 6):
+            fc.active_model_idx = i
+            priorities.append(scheduler.determine_priority(fc, consumer))
+        # More work behind a model gives a higher priority (upward rank)
+        self.assertEqual(sorted(priorities, reverse=True), priorities)
+        self.assertGreater(priorities[0], priorities[-1])
+        self.assertLessEqual(priorities[0], 5)
+
+    def test_critical_path_priority_not_below_reschedule_priority(self):
+        consumer = SimpleNamespace(exchange="consumer", routing_key="success")
+        for i in range(len(self.fc.flow.models)):
+            self.fc.active_model_idx = i
+            self.assertEqual(5, self.scheduler.determine_priority(self.fc, consumer))
+
+        scheduler = Scheduler(pub_routing_key_success="success", pub_routing_key_fail="fail",
+                              pub_routing_key_gpu="gpu", pub_routing_key_cpu="cpu", consumer_exchange="consumer",
+                              reschedule_priority=2, max_priority=5)
+        tail = self.fc.flow.dag.topological_order[-1]
+        self.fc.active_model_idx = tail
+        self.assertEqual(2, scheduler.determine_priority(self.fc, consumer))
+
+    def test_critical_path_breaks_ties(self):
+        # Models 1 and 2 are ready at the same time. The slow one is on the critical path and published first
+        done = self.fc.model_copy(update={"active_model_idx": 2, "active_model_runtime": 3000.0})
+        self.scheduler.record_runtime(done)
+        self.scheduler.update_mount_mapping(self.fc)
+        list(self.scheduler.yield_eligible_models_as_publish_contexts(self.fc))
+        self.fc.mount_mapping["STRUCT"] = "new fancy uid"
+        self.fc.mount_mapping["CT"] = "new bla"
+        self.scheduler.update_mount_mapping(self.fc)
+        elig_models = list(self.scheduler.yield_eligible_models_as_publish_contexts(self.fc))
+        self.assertEqual([2, 1], [m.active_model_idx for m in elig_models])
+
     @staticmethod
     def mock_model_run(fc: FlowContext):
         print(f"Executing model: {fc.active_model_idx}")
@@ -2,6 +2,8 @@ import logging
 import os.path
 import queue
 import signal
+import time
+from multiprocessing import Process
 from typing import Dict
 
 from DicomFlowLib.conf import load_configs
@@ -10,10 +12,11 @@ from DicomFlowLib.fs.file_storage_client import FileStorageClient
 from DicomFlowLib.log import init_logger
 from DicomFlowLib.mq import MQPub
 from scp import SCP
+from scp.upload_pool import UploadMetrics
 
 
 class Main:
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, upload_metrics: UploadMetrics | None = None):
         signal.signal(signal.SIGTERM, self.stop)
 
         self.running = None
@@ -45,6 +48,28 @@ class Main:
                        pynetdicom_log_level=int(config["PYNETDICOM_LOG_LEVEL"]),
                        routing_key_success=config["PUB_ROUTING_KEY_SUCCESS"],
                        routing_key_fail=config["PUB_ROUTING_KEY_FAIL"],
+                       tar_spool_dir=config["TAR_SPOOL_DIR"],
+                       tar_spool_max_size=int(config["TAR_SPOOL_MAX_SIZE"]),
+                       meta_tag_allow_list=config["META_TAG_ALLOW_LIST"],
+                       meta_tag_flow_directory=config["META_TAG_FLOW_DIRECTORY"],
+                       upload_workers=int(config["UPLOAD_WORKERS"]),
+                       upload_queue_depth=int(config["UPLOAD_QUEUE_DEPTH"]),
+                       study_aggregation=str(config["STUDY_AGGREGATION"]).lower() == "true",
+                       study_aggregation_quiet_period=float(config["STUDY_AGGREGATION_QUIET_PERIOD"]),
+                       series_early_publish=str(config["SERIES_EARLY_PUBLISH"]).lower() == "true",
+                       series_early_publish_quiet_period=float(config["SERIES_EARLY_PUBLISH_QUIET_PERIOD"]),
+                       series_early_publish_flow_directory=config["SERIES_EARLY_PUBLISH_FLOW_DIRECTORY"],
+                       reuse_port=int(config["AE_PROCESSES"]) > 1,
+                       upload_metrics=upload_metrics,
+                       admission_min_free_disk=int(config["ADMISSION_MIN_FREE_DISK"]),
+                       admission_max_pending_uploads=int(config["ADMISSION_MAX_PENDING_UPLOADS"]),
+                       admission_max_queue_depth=int(config["ADMISSION_MAX_QUEUE_DEPTH"]),
+                       admission_queues=config["ADMISSION_QUEUES"],
+                       admission_poll_interval=float(config["ADMISSION_POLL_INTERVAL"]),
+                       rabbit_hostname=config["RABBIT_HOSTNAME"],
+                       rabbit_port=int(config["RABBIT_PORT"]),
+                       wire_format=config["WIRE_FORMAT"],
+                       metadata_claim_check=str(config["METADATA_CLAIM_CHECK"]).lower() == "true",
                        log_level=int(config["LOG_LEVEL"]))
 
     def start(self):
@@ -66,12 +91,62 @@ class Main:
 
     def stop(self, signalnum=None, stack_frame=None):
         self.running = False
+        self.scp.stop()  # Finishes pending uploads, which still need the publisher
         self.mq.stop()
-        self.scp.stop()
         self.mq.join()
 
 
+def run_listener(config: Dict, upload_metrics: UploadMetrics):
+    # Drop the handlers inherited from the parent - Main sets up this listener's own, including the MQHandler
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    m = Main(config=config, upload_metrics=upload_metrics)
+    m.start()
+
+
+def run_listeners(config: Dict):
+    """
+    Forks AE_PROCESSES listener processes sharing AE_PORT through SO_REUSEPORT. Each listener has its own MQPub and
+    FileStorageClient, while the upload metrics are shared and logged from here.
+    """
+    # Stream and file only - an MQHandler's publisher thread would not survive the fork into the listeners
+    init_logger(name=None,  # init root logger,
+                log_format=config["LOG_FORMAT"],
+                log_dir=config["LOG_DIR"])
+    logger = logging.getLogger("storescp.listeners")
+    logger.setLevel(int(config["LOG_LEVEL"]))
+
+    upload_metrics = UploadMetrics()
+    listeners = []
+    for listener_id in range(int(config["AE_PROCESSES"])):
+        logger.info(f"Spawning SCP listener: {listener_id}")
+        p = Process(target=run_listener, args=(config, upload_metrics))
+        listeners.append(p)
+        p.start()
+
+    def stop(signalnum=None, stack_frame=None):
+        for listener in listeners:
+            if listener.is_alive():
+                listener.terminate()  # SIGTERM - each listener finishes its pending uploads
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while any(p.is_alive() for p in listeners):
+            time.sleep(float(config["METRICS_LOG_INTERVAL"]))
+            logger.info(f"Upload metrics (all listeners): {upload_metrics.as_dict()}")
+    except KeyboardInterrupt:
+        stop()
+
+    for p in listeners:
+        p.join()
+
+
 if __name__ == "__main__":
     config = load_configs(os.environ["CONF_DIR"], os.environ["CURRENT_CONF"])
-    m = Main(config=config)
-    m.start()
+    if int(config["AE_PROCESSES"]) > 1:
+        run_listeners(config)
+    else:
+        m = Main(config=config)
+        m.start()
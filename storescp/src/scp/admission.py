@@ -0,0 +1,123 @@
+import logging
+import shutil
+import tempfile
+import threading
+from typing import Dict, List
+
+import pika
+
+from .upload_pool import UploadMetrics, UploadPool
+
+
+class QueueDepthMonitor(threading.Thread):
+    """
+    Polls the number of ready messages of the given RabbitMQ queues on its own connection. Depths of queues
+    that cannot be polled are left out, so a broker hiccup does not block admission.
+    """
+    def __init__(self,
+                 rabbit_hostname: str,
+                 rabbit_port: int,
+                 queues: List[str],
+                 run_interval: float = 5,
+                 log_level: int = 20):
+        super().__init__(daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        self.rabbit_hostname = rabbit_hostname
+        self.rabbit_port = rabbit_port
+        self.queues = queues
+        self.run_interval = run_interval
+        self.depths: Dict[str, int] = {}
+        self._connection = None
+        self._channel = None
+        self.running = False
+        self.stopped = threading.Event()  # Wakes run() from its interval sleep on stop
+
+    def get_channel(self):
+        if self._connection is None or not self._connection.is_open:
+            self._connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbit_hostname,
+                                                                                 port=self.rabbit_port))
+        if self._channel is None or not self._channel.is_open:
+            self._channel = self._connection.channel()
+        return self._channel
+
+    def poll(self):
+        depths = {}
+        for queue in self.queues:
+            try:
+                # Passive declare only inspects the queue. It closes the channel if the queue does not exist yet
+                res = self.get_channel().queue_declare(queue=queue, passive=True)
+                depths[queue] = res.method.message_count
+            except Exception as e:
+                self.logger.debug(f"Could not poll depth of queue {queue}: {e}")
+        self.depths = depths
+
+    def run(self):
+        self.running = True
+        try:
+            while self.running:
+                self.poll()
+                self.stopped.wait(self.run_interval)
+        finally:
+            # pika connections are not thread safe, so the connection is only touched from this thread
+            if self._connection is not None and self._connection.is_open:
+                try:
+                    self._connection.close()
+                except Exception as e:
+                    self.logger.debug(str(e))
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class AdmissionControl:
+    """
+    Decides whether storescp should accept more data based on free disk of the spool dir, pending uploads,
+    depth of downstream queues and whether the upload queue of upload_pool is full. Limits set to 0 are disabled.
+    """
+    def __init__(self,
+                 upload_metrics: UploadMetrics,
+                 spool_dir: str | None = None,
+                 min_free_disk: int = 0,
+                 max_pending_uploads: int = 0,
+                 max_queue_depth: int = 0,
+                 queue_depth_monitor: QueueDepthMonitor | None = None,
+                 upload_pool: UploadPool | None = None):
+        self.upload_metrics = upload_metrics
+        self.spool_dir = spool_dir or tempfile.gettempdir()
+        self.min_free_disk = min_free_disk
+        self.max_pending_uploads = max_pending_uploads
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth_monitor = queue_depth_monitor
+        self.upload_pool = upload_pool
+
+    @property
+    def enabled(self):
+        return bool(self.min_free_disk or self.max_pending_uploads or self.max_queue_depth
+                    or (self.upload_pool is not None and self.upload_pool.queue_depth > 0))
+
+    def check(self) -> str | None:
+        """
+        Returns the reason to refuse new data, or None if it can be accepted.
+        """
+        if self.min_free_disk:
+            free = shutil.disk_usage(self.spool_dir).free
+            if free < self.min_free_disk:
+                return f"free disk of {self.spool_dir} is {free} bytes (min {self.min_free_disk})"
+
+        if self.max_pending_uploads:
+            pending = self.upload_metrics.as_dict()["pending_uploads"]
+            if pending >= self.max_pending_uploads:
+                return f"{pending} uploads are pending (max {self.max_pending_uploads})"
+
+        if self.upload_pool is not None and self.upload_pool.full():
+            return f"{self.upload_pool.queue_depth} uploads are waiting for a worker"
+
+        if self.max_queue_depth and self.queue_depth_monitor is not None:
+            for queue, depth in self.queue_depth_monitor.depths.items():
+                if depth >= self.max_queue_depth:
+                    return f"queue {queue} holds {depth} messages (max {self.max_queue_depth})"
+        return None
@@ -0,0 +1,225 @@
+"""
+End-to-end throughput benchmark of the SCP class. Synthetic CT/MR/RTSTRUCT studies are sent over loopback by
+concurrent SCUs to an SCP running in its own process against in-process stand-ins for RabbitMQ and file storage.
+
+Reports instances/s, MB/s, release-to-publish latency and peak RSS of the SCP process. The SCP process is spawned,
+not forked, so its RSS does not include the studies generated by the benchmark.
+
+Run from storescp/src: python -m scp.benchmarks.bench_scp_throughput --associations 16 --concurrency 4 \\
+    --series CT:100 MR:50 RTSTRUCT:1 --pdu-size 16382
+"""
+import argparse
+import multiprocessing
+import queue
+import resource
+import shutil
+import statistics
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from pydicom.uid import generate_uid
+from pynetdicom import AE, StoragePresentationContexts
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from DicomFlowLib.mq import PubModel
+from scp import SCP
+from .synthetic import generate_series, generate_rtstruct, encode_dataset
+
+
+class FileStorageStandIn:
+    """
+    Drains posted files like the file storage would, without keeping them.
+    """
+    def __init__(self):
+        self.posted_bytes = 0
+        self.lock = threading.Lock()
+
+    def post(self, file):
+        with open("/dev/null", "wb") as sink:
+            shutil.copyfileobj(file, sink)
+            size = file.tell()
+        with self.lock:
+            self.posted_bytes += size
+        return str(uuid.uuid4())
+
+
+class MQPubStandIn:
+    def __init__(self):
+        self.published: List[Tuple[float, bytes]] = []
+        self.lock = threading.Lock()
+
+    def add_publish_message(self, pub_model, pub_context):
+        with self.lock:
+            self.published.append((time.time(), pub_context.body))
+
+
+def run_scp(port: int, pdu_size: int, scp_kwargs: Dict, expected_contexts: int, timeout: float,
+            ready: multiprocessing.Queue, results: multiprocessing.Queue):
+    fs = FileStorageStandIn()
+    mq = MQPubStandIn()
+    scp = SCP(file_storage=fs,
+              ae_title="BENCH",
+              hostname="127.0.0.1",
+              port=port,
+              pub_models=[PubModel(exchange="storescp")],
+              pynetdicom_log_level=40,
+              routing_key_success="success",
+              routing_key_fail="fail",
+              mq_pub=mq,
+              maximum_pdu_size=pdu_size,
+              log_level=40,
+              **scp_kwargs)
+    scp.start(blocking=False)
+    rss_after_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    ready.put(True)
+
+    deadline = time.time() + timeout
+    while len(mq.published) < expected_contexts and time.time() < deadline:
+        time.sleep(0.01)
+    scp.stop()
+
+    # Parsed after the run, so it does not count against the SCP
+    published = []
+    for publish_time, body in mq.published:
+        context = SCPContext.model_validate_json(body)
+        published.append((context.dataframe["StudyInstanceUID"].iloc[0], publish_time))
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+    results.put({"published": published, "posted_bytes": fs.posted_bytes, "peak_rss": peak_rss,
+                 "rss_after_start": rss_after_start})
+
+
+def generate_study(series: List[Tuple[str, int]], rows: int, columns: int) -> List[bytes]:
+    """
+    Returns the encoded instances of one synthetic study. RTSTRUCTs reference the first image series.
+    """
+    study_uid = generate_uid()
+    image_series = []
+    datasets = []
+    for modality, instances in series:
+        if modality == "RTSTRUCT":
+            for _ in range(instances):
+                datasets.append(generate_rtstruct(image_series[0] if image_series else
+                                                  list(generate_series("CT", 1, rows, columns, study_uid))))
+        else:
+            dss = list(generate_series(modality, instances, rows, columns, study_uid=study_uid))
+            image_series.append(dss)
+            datasets += dss
+    return datasets
+
+
+def send_studies(port: int, pdu_size: int, studies: List[List], release_times: Dict, errors: List,
+                 lock: threading.Lock, timeout: float):
+    ae = AE(ae_title="BENCHSCU")
+    ae.requested_contexts = StoragePresentationContexts
+    ae.maximum_pdu_size = pdu_size
+    ae.acse_timeout = ae.dimse_timeout = ae.network_timeout = timeout
+    try:
+        for datasets in studies:
+            assoc = ae.associate("127.0.0.1", port, ae_title="BENCH")
+            if not assoc.is_established:
+                raise ConnectionError("Could not associate with the SCP")
+            for ds in datasets:
+                status = assoc.send_c_store(ds)
+                if "Status" not in status or status.Status != 0:
+                    assoc.abort()
+                    raise RuntimeError(f"C-STORE failed with status {status.get('Status', 'none (timeout)')}")
+            assoc.release()
+            with lock:
+                release_times[datasets[0].StudyInstanceUID] = time.time()
+    except Exception as e:
+        with lock:
+            errors.append(e)
+
+
+def parse_series(values: List[str]) -> List[Tuple[str, int]]:
+    series = []
+    for value in values:
+        modality, instances = value.split(":")
+        series.append((modality.upper(), int(instances)))
+    return series
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--associations", type=int, default=16, help="Number of studies, one per association")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of concurrent SCUs")
+    parser.add_argument("--series", nargs="+", default=["CT:100", "MR:50", "RTSTRUCT:1"],
+                        help="Series of each study as MODALITY:INSTANCES")
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--columns", type=int, default=512)
+    parser.add_argument("--pdu-size", type=int, default=0, help="Maximum PDU size. 0 is unlimited")
+    parser.add_argument("--port", type=int, default=11180)
+    parser.add_argument("--tar-spool-max-size", type=int, default=67108864)
+    parser.add_argument("--upload-workers", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before the benchmark is given up")
+    args = parser.parse_args()
+
+    # Spawned, so the SCP process does not inherit the studies generated below
+    mp = multiprocessing.get_context("spawn")
+    ready, results = mp.Queue(), mp.Queue()
+    scp_process = mp.Process(target=run_scp, args=(args.port,
+                                                   args.pdu_size,
+                                                   {"tar_spool_max_size": args.tar_spool_max_size,
+                                                    "upload_workers": args.upload_workers},
+                                                   args.associations,
+                                                   args.timeout,
+                                                   ready,
+                                                   results))
+    scp_process.start()
+    try:
+        ready.get(timeout=args.timeout)
+    except queue.Empty:
+        scp_process.terminate()
+        sys.exit("The SCP did not start")
+
+    series = parse_series(args.series)
+    print(f"Generating {args.associations} studies of {args.series}")
+    studies = [generate_study(series, args.rows, args.columns) for _ in range(args.associations)]
+    instances = sum(len(study) for study in studies)
+    payload = sum(len(encode_dataset(ds)) for study in studies for ds in study)
+
+    release_times, errors = {}, []
+    lock = threading.Lock()
+    scus = [threading.Thread(target=send_studies,
+                             args=(args.port, args.pdu_size, studies[i::args.concurrency], release_times, errors,
+                                   lock, args.timeout),
+                             daemon=True)
+            for i in range(args.concurrency)]
+
+    t0 = time.time()
+    for scu in scus:
+        scu.start()
+    for scu in scus:
+        scu.join(timeout=max(t0 + args.timeout - time.time(), 0))
+    try:
+        result = results.get(timeout=max(t0 + args.timeout - time.time(), 0) + 10)
+    except queue.Empty:
+        result = None
+    scp_process.join(timeout=10)
+    if scp_process.is_alive():
+        scp_process.terminate()
+
+    if errors:
+        sys.exit(f"SCU failed: {errors[0]}")
+    if result is None or len(result["published"]) < args.associations or any(scu.is_alive() for scu in scus):
+        published = len(result["published"]) if result is not None else "no"
+        sys.exit(f"Timed out after {args.timeout} s with {published} of {args.associations} studies published")
+    elapsed = max(publish_time for _, publish_time in result["published"]) - t0
+
+    latencies = [publish_time - release_times[study_uid] for study_uid, publish_time in result["published"]]
+    print(f"{instances} instances ({payload / 1e6:.1f} MB) in {elapsed:.2f} s "
+          f"with concurrency {args.concurrency} and pdu size {args.pdu_size or 'unlimited'}")
+    print(f"{'instances/s':>28}: {instances / elapsed:10.1f}")
+    print(f"{'MB/s':>28}: {payload / 1e6 / elapsed:10.1f}")
+    print(f"{'release-to-publish mean (s)':>28}: {statistics.mean(latencies):10.3f}")
+    print(f"{'release-to-publish max (s)':>28}: {max(latencies):10.3f}")
+    print(f"{'SCP RSS after start (MB)':>28}: {result['rss_after_start'] / 1e6:10.1f}")
+    print(f"{'SCP peak RSS (MB)':>28}: {result['peak_rss'] / 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
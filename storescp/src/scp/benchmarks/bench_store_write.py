@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the C-STORE write path of storescp: how many instances/s can be written into the
+association tar. Compares the former write path (temporary file per instance) with the current one
+(file meta and received dataset buffer written straight into the tar).
+
+Run from storescp/src: python -m scp.benchmarks.bench_store_write --instances 500
+"""
+import argparse
+import os
+import tempfile
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+from pydicom.filewriter import write_file_meta_info
+
+from scp.impl import AssocContext
+from .synthetic import generate_series, encoded_dataset_buffer
+
+
+def make_events(instances: int, rows: int, columns: int):
+    events = []
+    for ds in generate_series("CT", instances=instances, rows=rows, columns=columns):
+        events.append(SimpleNamespace(file_meta=ds.file_meta,
+                                      request=SimpleNamespace(DataSet=encoded_dataset_buffer(ds)),
+                                      path=os.path.join("/", ".".join([ds.Modality, ds.SeriesInstanceUID,
+                                                                       ds.SOPInstanceUID, "dcm"]))))
+    return events
+
+
+def write_with_temporary_file(assoc_context: AssocContext, event):
+    with tempfile.TemporaryFile() as f:
+        f.write(b'\x00' * 128)
+        f.write(b'DICM')
+        write_file_meta_info(f, event.file_meta)
+        f.write(event.request.DataSet.getvalue())
+        f.seek(0, 2)
+        info = assoc_context.tar.tarinfo(name=event.path)
+        info.size = f.tell()
+        f.seek(0)
+        assoc_context.tar.addfile(info, f)
+
+
+def write_with_buffers(assoc_context: AssocContext, event):
+    header = BytesIO()
+    header.write(b'\x00' * 128)
+    header.write(b'DICM')
+    write_file_meta_info(header, event.file_meta)
+    assoc_context.add_buffers_to_tar(event.path, header.getbuffer(), event.request.DataSet.getbuffer())
+
+
+def run(write_function, events, spool_dir, spool_max_size):
+    assoc_context = AssocContext(spool_dir=spool_dir, spool_max_size=spool_max_size)
+    t0 = time.perf_counter()
+    for event in events:
+        write_function(assoc_context, event)
+    assoc_context.tar.close()
+    elapsed = time.perf_counter() - t0
+    size = assoc_context.file.tell()
+    assoc_context.file.close()
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--columns", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--spool-dir", type=str, default=None)
+    parser.add_argument("--spool-max-size", type=int, default=67108864)
+    args = parser.parse_args()
+
+    events = make_events(args.instances, args.rows, args.columns)
+    print(f"{args.instances} instances of {args.rows}x{args.columns}, spool max size {args.spool_max_size}")
+    for name, function in [("temporary file (before)", write_with_temporary_file),
+                           ("buffers (after)", write_with_buffers)]:
+        best = min(run(function, events, args.spool_dir, args.spool_max_size)[0] for _ in range(args.repeats))
+        print(f"{name:>24}: {args.instances / best:10.1f} instances/s")
+
+
+if __name__ == "__main__":
+    main()
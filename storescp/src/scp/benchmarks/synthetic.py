@@ -0,0 +1,117 @@
+import os
+from io import BytesIO
+from typing import Iterable, List
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import write_dataset
+from pydicom.uid import ImplicitVRLittleEndian, PYDICOM_IMPLEMENTATION_UID, generate_uid
+
+SOP_CLASS_UIDS = {
+    "CT": "1.2.840.10008.5.1.4.1.1.2",
+    "MR": "1.2.840.10008.5.1.4.1.1.4",
+    "RTSTRUCT": "1.2.840.10008.5.1.4.1.1.481.3",
+}
+
+
+def new_dataset(modality: str, study_uid: str, series_uid: str) -> Dataset:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = SOP_CLASS_UIDS[modality]
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    ds.file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = modality
+    ds.PatientID = "0101010101"
+    ds.PatientName = "Synthetic^Patient"
+    ds.StudyDescription = "Synthetic study"
+    ds.SeriesDescription = f"Synthetic {modality} series"
+    return ds
+
+
+def generate_series(modality: str = "CT",
+                    instances: int = 100,
+                    rows: int = 512,
+                    columns: int = 512,
+                    study_uid: str | None = None) -> Iterable[Dataset]:
+    """
+    Yields a synthetic image series of the given modality with random pixel data.
+    """
+    study_uid = study_uid or generate_uid()
+    series_uid = generate_uid()
+    for i in range(instances):
+        ds = new_dataset(modality, study_uid, series_uid)
+        ds.InstanceNumber = i + 1
+        ds.ImagePositionPatient = [0, 0, i]
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.PixelData = os.urandom(rows * columns * 2)
+        yield ds
+
+
+def generate_rtstruct(image_series: List[Dataset], rois: int = 5, points: int = 64) -> Dataset:
+    """
+    Returns a synthetic RTSTRUCT referencing image_series, with one square contour per ROI on each image.
+    """
+    first = image_series[0]
+    ds = new_dataset("RTSTRUCT", first.StudyInstanceUID, generate_uid())
+    ds.InstanceNumber = 1
+    ds.StructureSetLabel = "Synthetic"
+
+    roi_sequence = Sequence()
+    contour_sequence = Sequence()
+    for roi_number in range(1, rois + 1):
+        roi = Dataset()
+        roi.ROINumber = roi_number
+        roi.ROIName = f"ROI_{roi_number}"
+        roi.ReferencedFrameOfReferenceUID = first.StudyInstanceUID
+        roi_sequence.append(roi)
+
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = roi_number
+        roi_contour.ROIDisplayColor = [255, 0, 0]
+        roi_contour.ContourSequence = Sequence()
+        for image in image_series:
+            image_reference = Dataset()
+            image_reference.ReferencedSOPClassUID = image.SOPClassUID
+            image_reference.ReferencedSOPInstanceUID = image.SOPInstanceUID
+
+            contour = Dataset()
+            contour.ContourImageSequence = Sequence([image_reference])
+            contour.ContourGeometricType = "CLOSED_PLANAR"
+            contour.NumberOfContourPoints = points
+            z = image.ImagePositionPatient[2]
+            contour.ContourData = [v for i in range(points) for v in (roi_number + i % 8, roi_number + i // 8, z)]
+            roi_contour.ContourSequence.append(contour)
+        contour_sequence.append(roi_contour)
+
+    ds.StructureSetROISequence = roi_sequence
+    ds.ROIContourSequence = contour_sequence
+    return ds
+
+
+def encode_dataset(ds: Dataset) -> bytes:
+    """
+    Encodes a dataset without file meta, as it arrives in a C-STORE request.
+    """
+    buffer = DicomBytesIO()
+    buffer.is_little_endian = True
+    buffer.is_implicit_VR = True
+    write_dataset(buffer, ds)
+    return buffer.getvalue()
+
+
+def encoded_dataset_buffer(ds: Dataset) -> BytesIO:
+    return BytesIO(encode_dataset(ds))
@@ -0,0 +1,30 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+
+class ContextJanitor(threading.Thread):
+    """
+    Periodically calls publish_function, which publishes the association contexts that have been quiet for long
+    enough when associations are aggregated.
+    """
+    def __init__(self, publish_function: Callable, run_interval: float = 1, log_level: int = 20):
+        super().__init__(daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        self.publish_function = publish_function
+        self.run_interval = run_interval
+        self.running = False
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                self.publish_function()
+            except Exception as e:
+                self.logger.error(str(e))
+            time.sleep(self.run_interval)
+
+    def stop(self):
+        self.running = False
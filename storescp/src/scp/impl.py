@@ -2,39 +2,137 @@ import logging
 import os
 import tarfile
 import tempfile
+import threading
+import time
 from io import BytesIO
-from typing import Dict, List
+from typing import Dict, List, Set
 
 from pydicom.filewriter import write_file_meta_info
 from pynetdicom import AE, evt, StoragePresentationContexts, _config, VerificationPresentationContexts
 from pynetdicom.events import Event
 from DicomFlowLib.data_structures.contexts import SCPContext, PublishContext
+from DicomFlowLib.data_structures.contexts.wire_format import WIRE_FORMATS
 from DicomFlowLib.mq import PubModel
 from DicomFlowLib.data_structures.flow import Destination
-from DicomFlowLib.fs import FileStorageClient
+from DicomFlowLib.fs import FileStorageClient, MetadataStore
 from DicomFlowLib.mq import MQPub
+from .tag_profile import build_tag_allow_list, load_flows
+from .series_triggers import SeriesTriggers
+from .upload_pool import UploadPool, UploadMetrics
+from .reuse_port import ReusePortAE
+from .admission import AdmissionControl, QueueDepthMonitor
+from .context_janitor import ContextJanitor
+
+
+class BufferChain:
+    """
+    Read-only file-like view over a sequence of buffers. read() hands out memoryview slices, so
+    tarfile can copy the buffers into the tar without intermediate copies.
+    """
+    def __init__(self, *buffers):
+        self.buffers = [memoryview(b).cast("B") for b in buffers]
+        self.size = sum(len(b) for b in self.buffers)
+        self._idx = 0
+        self._pos = 0
+
+    def read(self, size: int = -1):
+        if size < 0:
+            size = self.size
+        chunks = []
+        while size > 0 and self._idx < len(self.buffers):
+            buf = self.buffers[self._idx]
+            chunk = buf[self._pos:self._pos + size]
+            self._pos += len(chunk)
+            size -= len(chunk)
+            if self._pos >= len(buf):
+                self._idx += 1
+                self._pos = 0
+            chunks.append(chunk)
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return b"".join(chunks)
+
+    def release(self):
+        for buf in self.buffers:
+            buf.release()
 
 
 class AssocContext:
-    def __init__(self):
-        self.file = BytesIO()
+    def __init__(self, spool_dir: str | None = None, spool_max_size: int = 0):
+        self.spool_dir = spool_dir
+        self.spool_max_size = spool_max_size
+        self.file = self.new_spool_file()
         self.tar = tarfile.TarFile.open(fileobj=self.file, mode="w")
+        self.paths: Set[str] = set()
+        self.assoc_paths: Dict[int, Set[str]] = {}  # Paths added by each association
+        self.discarded = False  # Instances of an aborted association are still in the tar
 
         self.flow_context = SCPContext()
 
+        self.lock = threading.Lock()
+        self.open_assocs: Set[int] = set()  # Associations currently adding to this context
+        self.last_activity = time.time()
+        self.published = False
+        self.publish_when_quiet = False  # Series published early, also while associations are open
+
     def __del__(self):
+        if self.file.closed:  # Published or discarded
+            return
         try:
             self.tar.close()
         finally:
-            if not self.file.closed:
-                self.file.close()
-
-    def add_file_to_tar(self, path, file):
-        file.seek(0, 2)
+            self.file.close()
+
+    def new_spool_file(self):
+        # The tar is kept in memory up to spool_max_size bytes and then spilled to spool_dir.
+        # With spool_max_size <= 0 it is written directly to disk.
+        if self.spool_max_size > 0:
+            return tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, dir=self.spool_dir)
+        return tempfile.TemporaryFile(dir=self.spool_dir)
+
+    def discard_assoc(self, assoc_id: int):
+        """
+        Forgets the instances sent only by an aborted association. They are left out when the context is published,
+        and are accepted again if another association sends them.
+        """
+        paths = self.assoc_paths.pop(assoc_id, set()).difference(*self.assoc_paths.values())
+        if paths:
+            self.paths -= paths
+            self.discarded = True
+
+    def drop_discarded(self):
+        """
+        Rewrites the tar and the metadata with only the instances in paths. The last copy of an instance sent again
+        after being discarded is kept.
+        """
+        if not self.discarded:
+            return
+        self.tar.close()
+        self.file.seek(0)
+        file = self.new_spool_file()
+        with tarfile.TarFile.open(fileobj=self.file, mode="r") as src, \
+                tarfile.TarFile.open(fileobj=file, mode="w") as dst:
+            members = {member.name: member for member in src.getmembers() if member.name in self.paths}
+            for member in members.values():
+                dst.addfile(member, src.extractfile(member))
+        self.file.close()
+        self.file, self.tar = file, dst
+
+        dataframe = self.flow_context.dataframe
+        if dataframe is not None:
+            dataframe = dataframe[dataframe["dcm_path"].isin(self.paths)]
+            self.flow_context.dataframe = dataframe.drop_duplicates("dcm_path", keep="last").reset_index(drop=True)
+        self.discarded = False
+
+    def add_buffers_to_tar(self, path, *buffers):
+        chain = BufferChain(*buffers)
         info = tarfile.TarInfo(name=path)
-        info.size = file.tell()
-        file.seek(0)
-        self.tar.addfile(info, file)
+        info.size = chain.size
+        try:
+            self.tar.addfile(info, chain)
+        finally:
+            chain.release()
         return info.name
 
 class SCP:
@@ -50,6 +148,28 @@ class SCP:
                  blacklisted_hosts: List[str] | None = None,
                  whitelisted_hosts: List[str] | None = None,
                  maximum_pdu_size: int = 0,
+                 tar_spool_dir: str | None = None,
+                 tar_spool_max_size: int = 67108864,
+                 meta_tag_allow_list: List[str] | None = None,
+                 meta_tag_flow_directory: str | None = None,
+                 upload_workers: int = 2,
+                 upload_queue_depth: int = 8,
+                 study_aggregation: bool = False,
+                 study_aggregation_quiet_period: float = 30,
+                 series_early_publish: bool = False,
+                 series_early_publish_quiet_period: float = 10,
+                 series_early_publish_flow_directory: str | None = None,
+                 reuse_port: bool = False,
+                 upload_metrics: UploadMetrics | None = None,
+                 admission_min_free_disk: int = 0,
+                 admission_max_pending_uploads: int = 0,
+                 admission_max_queue_depth: int = 0,
+                 admission_queues: List[str] | None = None,
+                 admission_poll_interval: float = 5,
+                 rabbit_hostname: str | None = None,
+                 rabbit_port: int | None = None,
+                 wire_format: str = "json",
+                 metadata_claim_check: bool = False,
                  log_level: int = 20):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
@@ -57,7 +177,55 @@ class SCP:
         logging.getLogger("pynetdicom").setLevel(pynetdicom_log_level)
 
         self.maximum_pdu_size = maximum_pdu_size
+        self.tar_spool_dir = tar_spool_dir
+        if self.tar_spool_dir:
+            os.makedirs(self.tar_spool_dir, exist_ok=True)
+        self.tar_spool_max_size = tar_spool_max_size
+        self.meta_keywords = build_tag_allow_list(allow_list=meta_tag_allow_list,
+                                                  flow_directory=meta_tag_flow_directory)
+        if self.meta_keywords is not None:
+            self.logger.info(f"Extracting metadata tags: {sorted(self.meta_keywords)}")
         self.fs = file_storage
+        self.upload_pool = UploadPool(upload_function=self.publish,
+                                      workers=upload_workers,
+                                      queue_depth=upload_queue_depth,
+                                      metrics=upload_metrics,
+                                      log_level=log_level)
+        self.study_aggregation = study_aggregation
+        self.study_aggregation_quiet_period = study_aggregation_quiet_period
+        self.series_early_publish = series_early_publish
+        self.series_early_publish_quiet_period = series_early_publish_quiet_period
+        if self.study_aggregation and self.series_early_publish:
+            raise ValueError("Study aggregation and series early publishing cannot be used together")
+        self.series_triggers = None
+        if self.series_early_publish:
+            if not series_early_publish_flow_directory:
+                raise ValueError("Series early publishing needs the flow directory to know which series flows need")
+            self.series_triggers = SeriesTriggers(load_flows(series_early_publish_flow_directory))
+        self.context_janitor = ContextJanitor(publish_function=self.publish_idle_contexts, log_level=log_level)
+
+        self.queue_depth_monitor = None
+        if admission_max_queue_depth and admission_queues and rabbit_hostname:
+            self.queue_depth_monitor = QueueDepthMonitor(rabbit_hostname=rabbit_hostname,
+                                                         rabbit_port=rabbit_port,
+                                                         queues=admission_queues,
+                                                         run_interval=admission_poll_interval,
+                                                         log_level=log_level)
+        self.admission_control = AdmissionControl(upload_metrics=self.upload_pool.metrics,
+                                                  spool_dir=self.tar_spool_dir,
+                                                  min_free_disk=admission_min_free_disk,
+                                                  max_pending_uploads=admission_max_pending_uploads,
+                                                  max_queue_depth=admission_max_queue_depth,
+                                                  queue_depth_monitor=self.queue_depth_monitor,
+                                                  upload_pool=self.upload_pool)
+        self.reuse_port = reuse_port
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format {wire_format} - choose one of {WIRE_FORMATS}")
+        self.wire_format = wire_format
+        self.metadata_claim_check = metadata_claim_check
+        self.metadata_store = None
+        if self.metadata_claim_check:
+            self.metadata_store = MetadataStore(file_storage=file_storage, log_level=log_level)
         self.ae = None
         self.mq_pub = mq_pub
         self.pub_models = pub_models
@@ -70,7 +238,11 @@ class SCP:
         self.hostname = hostname
         self.port = port
 
-        self.assoc: Dict[AssocContext] = {}  # container for SCPContexts
+        # Container for SCPContexts. Keyed on association id, StudyInstanceUID if studies are aggregated or
+        # SeriesInstanceUID if series are published early
+        self.assoc: Dict[str | int, AssocContext] = {}
+        self.assoc_keys: Dict[int, Set[str | int]] = {}  # Keys of self.assoc each association has added to
+        self.assoc_lock = threading.Lock()
         if blacklisted_hosts:
             self.blacklisted_hosts = blacklisted_hosts
         else:
@@ -78,7 +250,7 @@ class SCP:
         self.whitelisted_hosts = whitelisted_hosts
 
     def __del__(self):
-        if self.ae is not None:
+        if getattr(self, "ae", None) is not None:  # Not set if __init__ failed
             self.ae.shutdown()
 
     def handle_established(self, event: Event):
@@ -104,34 +276,54 @@ class SCP:
             self.logger.debug("SCU host validated - you shall pass!")
             return 0x0000
 
-    def maybe_init_store(self, event):
+    def handle_requested(self, event: Event):
+        # Associations requested under load are rejected before any data is sent. Rejected transient with
+        # temporary congestion tells the sender to retry later
+        if not self.admission_control.enabled:
+            return
+
+        reason = self.admission_control.check()
+        if reason:
+            self.logger.warning(f"Rejecting association {event.assoc.native_id}: {reason}")
+            event.assoc.acse.send_reject(0x02, 0x03, 0x01)
+            event.assoc.kill()  # Sends the reject before the connection is closed, as pynetdicom does itself
+
+    def get_context_key(self, event, ds):
+        if self.study_aggregation:
+            return ds.StudyInstanceUID
+        elif self.series_early_publish and self.series_triggers.is_standalone(ds):
+            return ds.SeriesInstanceUID  # Series no flow needs together with other series get their own context
+        return event.assoc.native_id
+
+    def maybe_init_store(self, event, key, publish_when_quiet: bool = False) -> AssocContext:
         # Association id unique to this transaction
         # Set up all the thing
         assoc_id = event.assoc.native_id
 
-        # Check if already created
-        if assoc_id in self.assoc.keys():
-            return
+        with self.assoc_lock:
+            # Check if already created
+            if key not in self.assoc.keys():
+                ac = AssocContext(spool_dir=self.tar_spool_dir, spool_max_size=self.tar_spool_max_size)
+                ac.publish_when_quiet = publish_when_quiet
+                self.logger.info(f"Receiving dicom files")
 
-        ac = AssocContext()
-        self.logger.info(f"Receiving dicom files")
+                # Unwrap sender info
+                sender = Destination(host=event.assoc.requestor.address,
+                                     port=event.assoc.requestor.port,
+                                     ae_title=event.assoc.requestor._ae_title)
 
-        # Unwrap sender info
-        sender = Destination(host=event.assoc.requestor.address,
-                             port=event.assoc.requestor.port,
-                             ae_title=event.assoc.requestor._ae_title)
+                ac.flow_context.sender = sender
 
-        ac.flow_context.sender = sender
+                # Add to assocs dict
+                self.assoc[key] = ac
 
-        # Add to assocs dict
-        self.assoc[assoc_id] = ac
+            ac = self.assoc[key]
+            ac.open_assocs.add(assoc_id)
+            self.assoc_keys.setdefault(assoc_id, set()).add(key)
+            return ac
 
     def handle_store(self, event):
-        self.maybe_init_store(event)
         """Handle EVT_C_STORE events."""
-        assoc_id = event.assoc.native_id
-        assoc_context = self.assoc[assoc_id]
-
         self.logger.debug(f"HANDLE_STORE")
 
         # Get data set from event
@@ -142,45 +334,114 @@ class SCP:
 
         # Add file metas so they can be shipped on
         path_in_tar = os.path.join("/", ".".join([ds.Modality, ds.SeriesInstanceUID, ds.SOPInstanceUID, "dcm"]))
-        self.logger.debug(f"Writing dicom to path {path_in_tar}")
 
-        assoc_context.flow_context.add_meta_row(path_in_tar, ds)
+        header = BytesIO()
+        header.write(b'\x00' * 128)  # Write the preamble
+        header.write(b'DICM')  # Write prefix
+        write_file_meta_info(header, event.file_meta)  # Encode and write the File Meta Information
 
-        with tempfile.TemporaryFile() as f:
-            f.write(b'\x00' * 128)  # Write the preamble
-            f.write(b'DICM')  # Write prefix
-            write_file_meta_info(f, event.file_meta)  # Encode and write the File Meta Information
-            f.write(event.request.DataSet.getvalue())  # Write the encoded dataset
-            assoc_context.add_file_to_tar(path_in_tar, f)  ## does not need to seek(0)
+        key = self.get_context_key(event, ds)
+        while True:
+            assoc_context = self.maybe_init_store(event, key=key, publish_when_quiet=key != event.assoc.native_id)
+            with assoc_context.lock:
+                if assoc_context.published:
+                    continue  # Published by the context janitor in the meantime - a new context is needed
 
-        # Return a 'Success' status
-        return 0x0000
+                assoc_context.last_activity = time.time()
+                assoc_context.assoc_paths.setdefault(event.assoc.native_id, set()).add(path_in_tar)
+                if path_in_tar in assoc_context.paths:
+                    self.logger.debug(f"{path_in_tar} has already been received - skipping")
+                    return 0x0000
+
+                self.logger.debug(f"Writing dicom to path {path_in_tar}")
+                assoc_context.flow_context.add_meta_row(path_in_tar, ds, keywords=self.meta_keywords)
+
+                # The encoded dataset is written straight from the received buffer into the tar
+                assoc_context.add_buffers_to_tar(path_in_tar, header.getbuffer(), event.request.DataSet.getbuffer())
+                assoc_context.paths.add(path_in_tar)
+
+                # Return a 'Success' status
+                return 0x0000
 
     def handle_release(self, event: Event):
         self.maybe_release_storescp(event)
         return 0x0000
 
-    def maybe_release_storescp(self, event):
-        assoc_id = event.assoc.native_id
-        if assoc_id not in self.assoc.keys():
-            return
+    def handle_abort(self, event: Event):
+        self.maybe_release_storescp(event, aborted=True)
 
-        assoc_context = self.assoc[assoc_id]
+    def maybe_release_storescp(self, event, aborted: bool = False):
+        assoc_id = event.assoc.native_id
         self.logger.debug(f"HANDLE_RELEASE: {assoc_id}")
 
+        to_publish = []
+        with self.assoc_lock:
+            for key in self.assoc_keys.pop(assoc_id, set()):
+                assoc_context = self.assoc.get(key)
+                if assoc_context is None or assoc_id not in assoc_context.open_assocs:
+                    continue  # Already published by the context janitor
+                assoc_context.open_assocs.discard(assoc_id)
+                assoc_context.last_activity = time.time()
+
+                if aborted:
+                    self.logger.error(f"Association {assoc_id} was aborted - discarding its received files")
+                    with assoc_context.lock:
+                        assoc_context.discard_assoc(assoc_id)
+                        if not assoc_context.paths and not assoc_context.open_assocs:
+                            assoc_context.published = True  # Nothing left to publish
+                    if assoc_context.published:
+                        del self.assoc[key]
+                        assoc_context.file.close()
+                        continue
+
+                if self.study_aggregation:
+                    continue  # Published by the context janitor when the study has been quiet for long enough
+                if assoc_context.open_assocs:
+                    continue  # Series still received on another association
+
+                del self.assoc[key]
+                to_publish.append(assoc_context)
+
+        for assoc_context in to_publish:
+            self.submit_for_publish(assoc_context)
+
+    def is_idle(self, assoc_context: AssocContext, now: float):
+        if self.series_early_publish:
+            # Series are published when quiet, also if the association is still open. The rest of the association
+            # is published on release
+            return (assoc_context.publish_when_quiet
+                    and now - assoc_context.last_activity >= self.series_early_publish_quiet_period)
+        return not assoc_context.open_assocs and now - assoc_context.last_activity >= self.study_aggregation_quiet_period
+
+    def publish_idle_contexts(self, force: bool = False):
+        now = time.time()
+        with self.assoc_lock:
+            idle_keys = [key for key, ac in self.assoc.items() if force or self.is_idle(ac, now)]
+            to_publish = [self.assoc.pop(key) for key in idle_keys]
+
+        for assoc_context in to_publish:
+            self.submit_for_publish(assoc_context)
+
+    def submit_for_publish(self, assoc_context: AssocContext):
+        # Upload and publishing is left to the upload pool, so the association is not kept waiting
+        with assoc_context.lock:
+            assoc_context.published = True
+            assoc_context.tar.close()
+        self.upload_pool.submit(assoc_context, size=assoc_context.file.tell())
+
+    def publish(self, assoc_context):
         try:
             self.logger.info(f"STORESCP PUBLISH CONTEXT")
 
+            assoc_context.drop_discarded()
             assoc_context.flow_context.src_uid = self.publish_file_context(assoc_context=assoc_context)
+            if self.metadata_claim_check:
+                assoc_context.flow_context.offload_dataframe(self.metadata_store)
             self.publish_main_context(assoc_context=assoc_context)
 
             self.logger.info(f"STORESCP PUBLISH CONTEXT", )
-            self.logger.debug(f"HANDLE_RELEASE: {assoc_id}")
-        except Exception as e:
-            self.logger.error(str(e))
-            raise e
         finally:
-            del self.assoc[assoc_id]
+            assoc_context.file.close()
 
     def handle_echo(self, event):
         self.logger.debug(f"Replying to ECHO")
@@ -191,7 +452,7 @@ class SCP:
             pub_context = PublishContext(
                 routing_key=self.routing_key_success,
                 exchange=pub_model.exchange,
-                body=assoc_context.flow_context.model_dump_json().encode())
+                body=assoc_context.flow_context.to_body(self.wire_format))
 
             self.mq_pub.add_publish_message(pub_model, pub_context)
             #self.mq_pub.publish_message_callback(pub_model, pub_context)
@@ -203,21 +464,37 @@ class SCP:
 
     def stop(self, signalnum=None, stack_frame=None):
         self.ae.shutdown()
+        self.context_janitor.stop()
+        if self.queue_depth_monitor is not None:
+            self.queue_depth_monitor.stop()
+        self.publish_idle_contexts(force=True)
+        self.upload_pool.stop()
 
     def start(self, blocking=True):
         handler = [
+            (evt.EVT_REQUESTED, self.handle_requested),
             (evt.EVT_C_ECHO, self.handle_echo),
             (evt.EVT_ESTABLISHED, self.handle_established),
             (evt.EVT_C_STORE, self.handle_store),
             (evt.EVT_RELEASED, self.handle_release),
+            (evt.EVT_ABORTED, self.handle_abort),
         ]
 
         try:
             self.logger.info(
                 f"Starting SCP on host: {self.hostname}, port:{str(self.port)}, ae title: {self.ae_title}")
 
+            self.upload_pool.start()
+            if self.study_aggregation or self.series_early_publish:
+                self.context_janitor.start()
+            if self.queue_depth_monitor is not None:
+                self.queue_depth_monitor.start()
+
             # Create and run
-            self.ae = AE(ae_title=self.ae_title)
+            if self.reuse_port:
+                self.ae = ReusePortAE(ae_title=self.ae_title)
+            else:
+                self.ae = AE(ae_title=self.ae_title)
             self.ae.supported_contexts = StoragePresentationContexts + VerificationPresentationContexts
 
             self.ae.maximum_pdu_size = self.maximum_pdu_size
@@ -0,0 +1,26 @@
+import socket
+
+from pynetdicom import AE
+from pynetdicom.transport import ThreadedAssociationServer
+
+
+class ReusePortAssociationServer(ThreadedAssociationServer):
+    """
+    Association server binding with SO_REUSEPORT, so several listener processes can share the AE port and have the
+    kernel balance incoming associations between them.
+    """
+    def server_bind(self) -> None:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class ReusePortAE(AE):
+    def make_server(self, address, ae_title=None, contexts=None, ssl_context=None, evt_handlers=None,
+                    server_class=None, **kwargs):
+        return super().make_server(address,
+                                   ae_title=ae_title,
+                                   contexts=contexts,
+                                   ssl_context=ssl_context,
+                                   evt_handlers=evt_handlers,
+                                   server_class=ReusePortAssociationServer,
+                                   **kwargs)
@@ -0,0 +1,49 @@
+import functools
+import re
+from typing import List, Tuple
+
+from pydicom.dataset import Dataset
+
+from DicomFlowLib.data_structures.flow import Flow
+
+
+class SeriesTriggers:
+    """
+    Decides from the triggers of the flows which series can be published on their own when series are published
+    early. A series can if it satisfies all triggers of a flow by itself, and no flow needs it together with another
+    series, i.e. has a trigger matching the series and a trigger that does not. Triggers are evaluated like in the
+    fingerprinter, but on the first instance of the series, so only series level keywords are meaningful.
+    """
+    def __init__(self, flows: List[Flow]):
+        # Flows without triggers never match in the fingerprinter
+        self.flows = [flow for flow in flows if flow.triggers]
+        self.keywords = sorted({keyword for flow in self.flows for trigger in flow.triggers for keyword in trigger})
+        self.triggers = [[[(keyword, re.compile(pattern[1:] if pattern.startswith("~") else pattern),
+                            pattern.startswith("~"))
+                           for keyword, patterns in trigger.items() for pattern in patterns]
+                          for trigger in flow.triggers]
+                         for flow in self.flows]
+        # Series of a study mostly share their trigger values, so the decisions are cached on them
+        self.is_standalone_values = functools.lru_cache(maxsize=4096)(self.is_standalone_values)
+
+    def is_standalone(self, ds: Dataset) -> bool:
+        return self.is_standalone_values(tuple(str(ds[keyword].value) if keyword in ds else None
+                                               for keyword in self.keywords))
+
+    def is_standalone_values(self, values: Tuple[str | None, ...]) -> bool:
+        values = dict(zip(self.keywords, values))
+        satisfied = False
+        for flow_triggers in self.triggers:
+            matched = [all(self.match(values[keyword], pattern, negated) for keyword, pattern, negated in trigger)
+                       for trigger in flow_triggers]
+            if all(matched):
+                satisfied = True
+            elif any(matched):
+                return False  # The flow needs the series together with another series
+        return satisfied
+
+    @staticmethod
+    def match(value: str | None, pattern: re.Pattern, negated: bool) -> bool:
+        if value is None:  # Missing values never match
+            return negated
+        return (pattern.search(value) is not None) != negated
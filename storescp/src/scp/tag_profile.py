@@ -0,0 +1,59 @@
+import logging
+import os
+from typing import Iterable, List, Set
+
+import yaml
+from pydicom.datadict import tag_for_keyword
+
+from DicomFlowLib.data_structures.flow import Flow
+
+# Keywords used downstream regardless of the flows (tar naming in fingerprinter, pseudonyms in flow_tracker)
+REQUIRED_KEYWORDS = {"Modality", "StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "PatientID", "PatientName"}
+
+logger = logging.getLogger(__name__)
+
+
+def load_flows(flow_directory: str) -> List[Flow]:
+    flows = []
+    for fol, subs, files in os.walk(flow_directory):
+        for file in files:
+            if not file.endswith("yaml"):
+                continue
+            fp_path = os.path.join(fol, file)
+            try:
+                with open(fp_path) as r:
+                    flows.append(Flow(**yaml.safe_load(r)))
+            except Exception as e:
+                logger.error(f"Could not parse flow {fp_path} - it is ignored by storescp: {e}")
+    return flows
+
+
+def keywords_from_flow_directory(flow_directory: str) -> Set[str]:
+    keywords = set()
+    for flow in load_flows(flow_directory):
+        for trigger in flow.triggers:
+            keywords.update(trigger.keys())
+        keywords.update(flow.tar_subdir)
+    return keywords
+
+
+def build_tag_allow_list(allow_list: Iterable[str] | None = None,
+                         flow_directory: str | None = None) -> Set[str] | None:
+    """
+    Returns the DICOM keywords storescp should extract into the metadata DataFrame, or None if every tag
+    should be extracted.
+    """
+    if not allow_list and not flow_directory:
+        return None
+
+    keywords = set(REQUIRED_KEYWORDS)
+    if allow_list:
+        keywords.update(allow_list)
+    if flow_directory:
+        keywords.update(keywords_from_flow_directory(flow_directory))
+
+    # tar_subdir may contain literal folder names, and triggers may contain typos - only keep DICOM keywords
+    invalid = {kw for kw in keywords if tag_for_keyword(kw) is None}
+    if invalid:
+        logger.warning(f"Ignoring unknown DICOM keywords in tag profile: {sorted(invalid)}")
+    return keywords - invalid
@@ -0,0 +1,225 @@
+import os
+import socket
+import tarfile
+import tempfile
+import threading
+import unittest
+import uuid
+from io import BytesIO
+from types import SimpleNamespace
+
+import yaml
+from pydicom.uid import generate_uid
+from pynetdicom import AE, StoragePresentationContexts
+
+from DicomFlowLib.data_structures.contexts import SCPContext
+from DicomFlowLib.data_structures.flow import Flow
+from DicomFlowLib.mq import PubModel
+from scp import SCP
+from scp.benchmarks.synthetic import generate_series, generate_rtstruct, encoded_dataset_buffer
+from scp.series_triggers import SeriesTriggers
+from scp.upload_pool import UploadPool
+
+
+def make_flow(name, *triggers):
+    return {"name": name, "triggers": list(triggers), "models": [{"docker_kwargs": {"image": "busybox"}}]}
+
+
+class FileStorageStandIn:
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def post(self, file) -> str:
+        uid = str(uuid.uuid4())
+        with self.lock:
+            self.files[uid] = file.read()
+        return uid
+
+
+class MQPubStandIn:
+    def __init__(self):
+        self.published = []
+
+    def add_publish_message(self, pub_model, pub_context):
+        self.published.append(SCPContext.from_body(pub_context.body))
+
+
+class TestSCP(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileStorageStandIn()
+        self.mq = MQPubStandIn()
+
+    def make_scp(self, port: int | None = None, **kwargs):
+        scp = SCP(file_storage=self.fs,
+                  ae_title="TEST",
+                  hostname="127.0.0.1",
+                  port=port or 0,
+                  pub_models=[PubModel(exchange="storescp")],
+                  pynetdicom_log_level=40,
+                  routing_key_success="success",
+                  routing_key_fail="fail",
+                  mq_pub=self.mq,
+                  log_level=40,
+                  **kwargs)
+        if port:
+            scp.start(blocking=False)
+            self.addCleanup(scp.stop)
+        else:  # Events are sent to the handlers directly
+            scp.upload_pool.start()
+            self.addCleanup(scp.upload_pool.stop)
+        return scp
+
+    @staticmethod
+    def event(assoc_id: int, ds=None):
+        assoc = SimpleNamespace(native_id=assoc_id,
+                                requestor=SimpleNamespace(address="127.0.0.1", port=104, _ae_title="SCU"))
+        if ds is None:
+            return SimpleNamespace(assoc=assoc)
+        return SimpleNamespace(assoc=assoc, dataset=ds, file_meta=ds.file_meta,
+                               request=SimpleNamespace(DataSet=encoded_dataset_buffer(ds)))
+
+    @staticmethod
+    def path(ds):
+        return f"/{ds.Modality}.{ds.SeriesInstanceUID}.{ds.SOPInstanceUID}.dcm"
+
+    def store(self, scp, assoc_id, datasets):
+        for ds in datasets:
+            self.assertEqual(0x0000, scp.handle_store(self.event(assoc_id, ds)))
+
+    def published_members(self, i=0, contexts=1):
+        self.assertEqual(contexts, len(self.mq.published))
+        context = self.mq.published[i]
+        with tarfile.open(fileobj=BytesIO(self.fs.files[context.src_uid])) as tar:
+            return set(tar.getnames()), set(context.dataframe["dcm_path"])
+
+    def test_aborted_association_is_dropped_from_aggregated_study(self):
+        scp = self.make_scp(study_aggregation=True, study_aggregation_quiet_period=0)
+        study_uid = generate_uid()
+        ct = list(generate_series("CT", 3, 4, 4, study_uid=study_uid))
+        mr = list(generate_series("MR", 2, 4, 4, study_uid=study_uid))
+
+        self.store(scp, 1, ct)
+        self.store(scp, 2, mr)
+        scp.handle_release(self.event(1))
+        scp.handle_abort(self.event(2))
+        scp.publish_idle_contexts()
+        scp.upload_pool.queue.join()
+
+        members, dcm_paths = self.published_members()
+        self.assertEqual(members, dcm_paths)
+        self.assertEqual({self.path(ds) for ds in ct}, members)
+
+    def test_aborted_instances_sent_again_are_kept(self):
+        scp = self.make_scp(study_aggregation=True, study_aggregation_quiet_period=0)
+        ct = list(generate_series("CT", 3, 4, 4))
+
+        # ct[1] is sent on both associations and kept, ct[0] is sent again after the abort
+        self.store(scp, 1, ct[:2])
+        self.store(scp, 2, ct[1:])
+        scp.handle_abort(self.event(1))
+        self.assertEqual({self.path(ds) for ds in ct[1:]}, scp.assoc[ct[0].StudyInstanceUID].paths)
+        self.store(scp, 3, ct[:1])
+        scp.handle_release(self.event(2))
+        scp.handle_release(self.event(3))
+        scp.publish_idle_contexts()
+        scp.upload_pool.queue.join()
+
+        members, dcm_paths = self.published_members()
+        self.assertEqual(3, len(members))
+        self.assertEqual(members, dcm_paths)
+        self.assertEqual(3, len(self.mq.published[0].dataframe))
+
+    def test_aborted_only_association_is_not_published(self):
+        scp = self.make_scp(study_aggregation=True, study_aggregation_quiet_period=0)
+        self.store(scp, 1, generate_series("CT", 2, 4, 4))
+        scp.handle_abort(self.event(1))
+        scp.publish_idle_contexts()
+        scp.upload_pool.queue.join()
+        self.assertEqual([], self.mq.published)
+        self.assertEqual({}, scp.assoc)
+
+    def test_series_early_publish_keeps_series_needed_together(self):
+        flows = [make_flow("ct_struct", {"Modality": ["^CT$"]}, {"Modality": ["RTSTRUCT"]}),
+                 make_flow("mr", {"Modality": ["MR"]})]
+        with tempfile.TemporaryDirectory() as flow_directory:
+            for flow in flows:
+                with open(os.path.join(flow_directory, f"{flow['name']}.yaml"), "w") as w:
+                    yaml.safe_dump(flow, w)
+            scp = self.make_scp(series_early_publish=True, series_early_publish_quiet_period=0,
+                                series_early_publish_flow_directory=flow_directory)
+
+        study_uid = generate_uid()
+        ct = list(generate_series("CT", 2, 4, 4, study_uid=study_uid))
+        mr = list(generate_series("MR", 2, 4, 4, study_uid=study_uid))
+        self.store(scp, 1, ct + mr)
+
+        # Only the MR series is published while the association is open
+        scp.publish_idle_contexts()
+        scp.upload_pool.queue.join()
+        members, _ = self.published_members()
+        self.assertEqual({self.path(ds) for ds in mr}, members)
+
+        rtstruct = generate_rtstruct(ct)
+        self.store(scp, 1, [rtstruct])
+        scp.handle_release(self.event(1))
+        scp.upload_pool.queue.join()
+        members, dcm_paths = self.published_members(i=1, contexts=2)
+        self.assertEqual({self.path(ds) for ds in ct + [rtstruct]}, members)
+        self.assertEqual(members, dcm_paths)
+
+    def test_series_early_publish_needs_flows(self):
+        with self.assertRaises(ValueError):
+            self.make_scp(series_early_publish=True)
+
+    def test_association_is_rejected_under_load(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        scp = self.make_scp(port=port, admission_min_free_disk=1 << 62)
+
+        ae = AE(ae_title="SCU")
+        ae.requested_contexts = StoragePresentationContexts
+        assoc = ae.associate("127.0.0.1", port, ae_title="TEST")
+        self.assertTrue(assoc.is_rejected)
+        self.assertEqual(0x01, assoc.acceptor.primitive.diagnostic)  # Temporary congestion
+
+        scp.admission_control.min_free_disk = 0
+        assoc = ae.associate("127.0.0.1", port, ae_title="TEST")
+        self.assertTrue(assoc.is_established)
+        assoc.release()
+
+
+class TestUploadPool(unittest.TestCase):
+    def test_submit_does_not_block_when_full(self):
+        pool = UploadPool(upload_function=lambda job: None, workers=1, queue_depth=2)
+        self.assertFalse(pool.full())
+        for i in range(3):  # Not started, so the jobs are left waiting
+            pool.submit(i)
+        self.assertTrue(pool.full())
+        pool.start()
+        pool.queue.join()
+        self.assertFalse(pool.full())
+        pool.stop()
+        self.assertEqual(3, pool.metrics.as_dict()["uploads"])
+
+
+class TestSeriesTriggers(unittest.TestCase):
+    def test_is_standalone(self):
+        ct, mr, rtstruct = (next(generate_series(modality, 1, 4, 4)) for modality in ("CT", "MR", "CT"))
+        rtstruct = generate_rtstruct([rtstruct])
+        series_triggers = SeriesTriggers([Flow(**make_flow("ct_struct", {"Modality": ["^CT$"]},
+                                                           {"Modality": ["RTSTRUCT"]})),
+                                          Flow(**make_flow("not_ct", {"Modality": ["~^CT$"],
+                                                                      "SeriesDescription": ["Synthetic"]})),
+                                          Flow(**make_flow("no_triggers"))])
+        self.assertFalse(series_triggers.is_standalone(ct))  # Needed together with the RTSTRUCT
+        self.assertFalse(series_triggers.is_standalone(rtstruct))
+        self.assertTrue(series_triggers.is_standalone(mr))
+
+        mr.SeriesDescription = "Other"
+        self.assertFalse(series_triggers.is_standalone(mr))  # No flow needs it
+
+
+if __name__ == '__main__':
+    unittest.main()
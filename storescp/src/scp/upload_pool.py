@@ -0,0 +1,109 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Dict
+
+
+class UploadMetrics:
+    FIELDS = ["pending_uploads", "bytes_in_flight", "uploads", "failed_uploads",
+              "upload_seconds_total", "upload_seconds_last"]
+
+    def __init__(self):
+        # Kept in shared memory, so the metrics of forked listener processes add up
+        self._values = multiprocessing.Array("d", len(self.FIELDS))
+
+    def _add(self, field: str, value: float):
+        self._values[self.FIELDS.index(field)] += value
+
+    def submitted(self, size: int):
+        with self._values.get_lock():
+            self._add("pending_uploads", 1)
+            self._add("bytes_in_flight", size)
+
+    def finished(self, size: int, seconds: float, success: bool):
+        with self._values.get_lock():
+            self._add("pending_uploads", -1)
+            self._add("bytes_in_flight", -size)
+            if success:
+                self._add("uploads", 1)
+                self._add("upload_seconds_total", seconds)
+                self._values[self.FIELDS.index("upload_seconds_last")] = seconds
+            else:
+                self._add("failed_uploads", 1)
+
+    def as_dict(self) -> Dict:
+        with self._values.get_lock():
+            values = dict(zip(self.FIELDS, self._values[:]))
+
+        uploads = values["uploads"]
+        return {"pending_uploads": int(values["pending_uploads"]),
+                "bytes_in_flight": int(values["bytes_in_flight"]),
+                "uploads": int(uploads),
+                "failed_uploads": int(values["failed_uploads"]),
+                "upload_seconds_last": round(values["upload_seconds_last"], 3),
+                "upload_seconds_mean": round(values["upload_seconds_total"] / uploads, 3) if uploads else 0.0}
+
+
+class UploadPool:
+    """
+    Pool of threads running upload_function on submitted jobs, so that association release handlers do not wait
+    for the upload. submit() never blocks, as it runs on the event threads of pynetdicom. Instead the pool is full()
+    when queue_depth jobs are waiting for a worker, and admission control rejects new associations until it is not.
+    """
+    def __init__(self,
+                 upload_function: Callable,
+                 workers: int = 2,
+                 queue_depth: int = 8,
+                 metrics: UploadMetrics | None = None,
+                 log_level: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        self.upload_function = upload_function
+        self.queue = queue.Queue()
+        self.queue_depth = queue_depth  # <= 0 is never full
+        self.metrics = metrics if metrics is not None else UploadMetrics()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+
+    def full(self) -> bool:
+        return 0 < self.queue_depth <= self.queue.qsize()
+
+    def submit(self, job, size: int = 0):
+        self.metrics.submitted(size)
+        self.queue.put((job, size))
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:  # Stop signal
+                self.queue.task_done()
+                return
+
+            job, size = item
+            t0 = time.time()
+            success = False
+            try:
+                self.upload_function(job)
+                success = True
+            except Exception as e:
+                self.logger.error(str(e))
+                self.logger.error(traceback.format_exc())
+            finally:
+                self.metrics.finished(size=size, seconds=time.time() - t0, success=success)
+                self.queue.task_done()
+                self.logger.info(f"Upload metrics: {self.metrics.as_dict()}")
+
+    def stop(self):
+        # Pending uploads are finished before the workers stop
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            if t.is_alive():
+                t.join()
@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import tarfile
@@ -33,7 +32,7 @@ class STORESCU:
 
     def mq_entrypoint(self, basic_deliver, body) -> Iterable[PublishContext]:
 
-        fc = FlowContext(**json.loads(body.decode()))
+        fc = FlowContext.from_body(body)
         self.uid = fc.uid
 
         self.logger.info("SCU")
@@ -62,7 +61,7 @@ class STORESCU:
         self.logger.info("SCU")
         self.uid = None
 
-        return [PublishContext(body=fc.model_dump_json().encode(), routing_key=self.pub_routing_key_success)]
+        return [PublishContext(body=fc.to_body(), routing_key=self.pub_routing_key_success)]
 
     def post_folder_to_dicom_node(self, dicom_dir, destination: Destination) -> bool:
         ae = AE(ae_title=self.ae_title)